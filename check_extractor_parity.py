@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# check_extractor_parity.py
+# 抽出バックエンド(bs4, lxml)が同じテキスト・同じハッシュを返すかを確認します
+
+import sys
+import json
+import argparse
+import logging
+from dotenv import load_dotenv
+from glc_utils import get_db_connection, fetch_url_content, calculate_sha3_512
+from glc_extract import EXTRACTORS
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def compare_extractors(content, tag, tag_id, tag_class):
+    """利用可能な全バックエンドで抽出し、バックエンド名をキーとするハッシュ値の辞書を返します。"""
+    hashes = {}
+    for name, extractor in EXTRACTORS.items():
+        if not extractor.available():
+            continue
+        if not extractor.supports(content):
+            hashes[name] = "unsupported (bs4 fallback)"
+            continue
+        texts = extractor.extract(extractor.parse(content), tag, tag_id, tag_class)
+        hashes[name] = calculate_sha3_512('\n'.join(texts)) if texts else None
+    return hashes
+
+# ネットワークとDBを使わずに確認するための文書。expectは次のいずれかです。
+# identical: lxmlがbs4と同じハッシュを返すこと
+# unsupported: lxmlのsupports()がFalseを返し、bs4で抽出されること
+FIXTURES = [
+    {"name": "indent", "expect": "identical", "tag": "div", "tag_id": "news", "tag_class": None,
+     "content": '<html><body><div id="news">\n    <ul>\n        <li>A</li>\n        <li>B</li>\n    </ul>\n</div></body></html>'},
+    {"name": "tab", "expect": "identical", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<html><body><div id="x"><span>1</span>\t<span>2</span></div></body></html>'},
+    {"name": "pre", "expect": "identical", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<html><body><div id="x"><pre>\n  a\n   <b>b</b>\n  </pre>\n\n <p>c</p></div></body></html>'},
+    {"name": "comment", "expect": "identical", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<html><body><div id="x">a <!-- c -->  \n <i>b</i></div></body></html>'},
+    {"name": "table", "expect": "identical", "tag": "table", "tag_id": "x", "tag_class": None,
+     "content": '<html><body><table id="x">\n <tr>\n  <td>a</td>\n  <td>b</td>\n </tr>\n</table></body></html>'},
+    {"name": "page", "expect": "identical", "tag": "main", "tag_id": None, "tag_class": None,
+     "content": '<!DOCTYPE html>\n<html lang="ja">\n<head>\n  <meta charset="utf-8">\n  <title>お知らせ &amp; 更新情報</title>\n'
+                '  <script>if (a && b) { location.href = "?a=1&b=2"; }</script>\n</head>\n<body>\n'
+                '  <main>\n    <h1>更新情報</h1>\n    <p>2024年&nbsp;4月&copy; <a href="/news?id=1&amp;p=2">詳細</a></p>\n'
+                '    <ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp></ruby>\n  </main>\n</body>\n</html>\n<!-- cached -->\n'},
+    {"name": "textarea", "expect": "unsupported", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<div id="x"><textarea><b>x</b> &amp; y</textarea>z</div>'},
+    {"name": "cdata", "expect": "unsupported", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<div id="x">a<![CDATA[b<c>]]>d</div>'},
+    {"name": "unknown_entity", "expect": "unsupported", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<div id="x">a &unknown; b</div>'},
+    {"name": "unterminated_entity", "expect": "unsupported", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<div id="x">&hellip x &#65a</div>'},
+    {"name": "after_html", "expect": "unsupported", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<html><body><div id="x">a</div></body></html><div id="x">b</div>'},
+    {"name": "title_markup", "expect": "unsupported", "tag": "title", "tag_id": None, "tag_class": None,
+     "content": '<html><head><title>a <b>t</b></title></head><body>x</body></html>'},
+    # libxml2が終了タグを補う・入れ子を直す・要素を追加する文書
+    {"name": "div_in_p", "expect": "unsupported", "tag": "p", "tag_id": None, "tag_class": None,
+     "content": '<html><body><p>a<div>b</div>c</p></body></html>'},
+    {"name": "unclosed_li", "expect": "unsupported", "tag": "li", "tag_id": None, "tag_class": None,
+     "content": '<html><body><ul><li>a<li>b</ul></body></html>'},
+    {"name": "unclosed_p", "expect": "unsupported", "tag": "p", "tag_id": None, "tag_class": None,
+     "content": '<html><body><p>one<p>two</body></html>'},
+    {"name": "unclosed_td", "expect": "unsupported", "tag": "td", "tag_id": None, "tag_class": None,
+     "content": '<html><body><table><td>a<td>b</table></body></html>'},
+    {"name": "nested_a", "expect": "unsupported", "tag": "a", "tag_id": None, "tag_class": None,
+     "content": '<html><body><a href=1>a<a href=2>b</a></a></body></html>'},
+    {"name": "text_only", "expect": "unsupported", "tag": "html", "tag_id": None, "tag_class": None,
+     "content": 'text only'},
+    {"name": "fragment", "expect": "unsupported", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<div id="x">a</div>'},
+    {"name": "unclosed_quote", "expect": "unsupported", "tag": "div", "tag_id": "x", "tag_class": None,
+     "content": '<div id="x"><i class="a>b</i>c</div>'},
+]
+
+def check_fixtures():
+    """FIXTURESの各文書でバックエンドのハッシュを比較し、期待と異なる結果のリストを返します。"""
+    results = []
+    for fixture in FIXTURES:
+        hashes = compare_extractors(fixture['content'], fixture['tag'], fixture['tag_id'], fixture['tag_class'])
+        if 'lxml' not in hashes:
+            logger.warning("lxmlがインストールされていないため、確認できません。")
+            break
+        if fixture['expect'] == 'unsupported':
+            passed = str(hashes['lxml']).startswith("unsupported")
+        else:
+            passed = hashes['lxml'] == hashes['bs4']
+        results.append({"name": fixture['name'], "expect": fixture['expect'], "hashes": hashes, "passed": passed})
+    return results
+
+def check_parity(conn, url=None):
+    cursor = conn.cursor(dictionary=True)
+    results = []
+    try:
+        if url:
+            cursor.execute("""
+                SELECT id, url, tag, tag_id, tag_class FROM scraping_targets
+                WHERE check_lastmodified = FALSE AND url = %s
+            """, (url,))
+        else:
+            cursor.execute("""
+                SELECT id, url, tag, tag_id, tag_class FROM scraping_targets
+                WHERE check_lastmodified = FALSE
+            """)
+        for target in cursor.fetchall():
+            content = fetch_url_content(target['url'])
+            if content is None:
+                results.append({"target_id": target['id'], "url": target['url'], "error": "fetch failed"})
+                continue
+            hashes = compare_extractors(content, target['tag'], target['tag_id'], target['tag_class'])
+            comparable = [h for h in hashes.values() if not str(h).startswith("unsupported")]
+            results.append({
+                "target_id": target['id'],
+                "url": target['url'],
+                "hashes": hashes,
+                "identical": len(set(comparable)) <= 1
+            })
+    finally:
+        cursor.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that all extraction backends produce identical hashes")
+    parser.add_argument("--db", help="Database name")
+    parser.add_argument("--url", help="Check only this target URL")
+    parser.add_argument("--fixtures", action="store_true", help="Check built-in documents without network or database access")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        results = check_fixtures()
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        failures = [r for r in results if not r['passed']]
+        if failures:
+            logger.warning(f"期待と異なる結果になった文書: {', '.join(r['name'] for r in failures)}")
+            sys.exit(1)
+        return
+    if not args.db:
+        parser.error("--db is required unless --fixtures is given")
+
+    conn = get_db_connection(args.db)
+    if conn is None:
+        logger.error("データベース接続の取得に失敗しました。")
+        sys.exit(2)
+    try:
+        results = check_parity(conn, args.url)
+    finally:
+        conn.close()
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    mismatches = [r for r in results if r.get('identical') is False]
+    if mismatches:
+        logger.warning(f"ハッシュが一致しないターゲット: {len(mismatches)}件")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -5,61 +5,34 @@ import argparse
 import json
 import logging
 from dotenv import load_dotenv
-import mysql.connector
-import os
+from glc_db import get_db_connection
+from glc_diff import fetch_latest_pairs
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def get_db_connection(db_name):
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=db_name
-        )
-        return connection
-    except mysql.connector.Error as e:
-        logger.error(f"データベース接続エラー: {e}")
-        return None
-
 def check_updates(conn, debug=False):
-    cursor = conn.cursor(dictionary=True)
     comparison_results = []
 
     try:
-        cursor.execute("""
-            SELECT t.id, t.url, 
-                   r1.last_content AS latest_content, r1.last_update AS latest_update,
-                   r2.last_content AS previous_content, r2.last_update AS previous_update
-            FROM scraping_targets t
-            JOIN scraping_results r1 ON t.id = r1.target_id
-            LEFT JOIN scraping_results r2 ON t.id = r2.target_id AND r2.id < r1.id
-            WHERE r1.id = (SELECT MAX(id) FROM scraping_results WHERE target_id = t.id)
-            AND (r2.id IS NULL OR r2.id = (SELECT MAX(id) FROM scraping_results WHERE target_id = t.id AND id < r1.id))
-        """)
-        
-        results = cursor.fetchall()
+        results = fetch_latest_pairs(conn)
         
         for result in results:
             comparison_result = {
                 "target_id": result['id'],
                 "url": result['url'],
                 "last_update": result['latest_update'].isoformat() if result['latest_update'] else None,
-                "last_content": result['latest_content'],
+                "last_digest": result['latest_digest'].hex() if result['latest_digest'] else None,
                 "previous_update": result['previous_update'].isoformat() if result['previous_update'] else None,
-                "previous_content": result['previous_content'],
-                "is_updated": result['latest_content'] != result['previous_content'] if result['previous_content'] is not None else None
+                "previous_digest": result['previous_digest'].hex() if result['previous_digest'] else None,
+                "is_updated": result['latest_digest'] != result['previous_digest'] if result['previous_digest'] is not None else None
             }
             comparison_results.append(comparison_result)
 
     except Exception as e:
         logger.error(f"更新チェック中にエラーが発生しました: {e}")
-    finally:
-        cursor.close()
 
     return comparison_results
 
@@ -1,20 +1,11 @@
 #!/usr/bin/env python3
 
-import mysql.connector
 import argparse
 from dotenv import load_dotenv
-import os
+from glc_db import get_db_connection, DB_ERRORS
 
 load_dotenv()
 
-def get_db_connection(db_name):
-    return mysql.connector.connect(
-        host=os.getenv('DB_HOST'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        database=db_name
-    )
-
 def display_updated_targets_view(db_name):
     conn = get_db_connection(db_name)
     cursor = conn.cursor(dictionary=True)
@@ -40,7 +31,7 @@ def display_updated_targets_view(db_name):
             print(f"QMD Name: {row['qmd_name']}")
             print("---------------------------------")
 
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Error: {err}")
     finally:
         cursor.close()
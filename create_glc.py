@@ -1,38 +1,28 @@
 #!/usr/bin/env python3
 
 import argparse
-import mysql.connector
-from mysql.connector import Error
-import os
+import sys
 from dotenv import load_dotenv
+from glc_db import get_db_connection, DB_BACKEND, DB_ERRORS
+from glc_migrate import upgrade
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
-def get_db_connection(db_name=None):
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST', 'goudge-tc01-sid'),
-            database=db_name,
-            user=os.getenv('DB_USER', 'mguuji'),
-            password=os.getenv('DB_PASSWORD')
-        )
-        return connection
-    except Error as e:
-        print(f"データベース接続エラー: {e}")
-        return None
-
 def execute_query(connection, query):
     cursor = connection.cursor()
     try:
         cursor.execute(query)
         connection.commit()
-    except Error as e:
+    except DB_ERRORS as e:
         print(f"クエリ実行エラー: {e}")
     finally:
         cursor.close()
 
 def create_database(db_name):
+    if DB_BACKEND == 'sqlite':
+        # SQLiteのデータベースファイルは最初の接続で作成される
+        return
     connection = get_db_connection()
     if connection is not None:
         execute_query(connection, f"CREATE DATABASE IF NOT EXISTS {db_name}")
@@ -41,29 +31,31 @@ def create_database(db_name):
     else:
         print("データベース接続に失敗しました。")
 
-def create_schema(db_name, schema_file):
+def create_schema(db_name):
     connection = get_db_connection(db_name)
     if connection is None:
-        return
-
-    with open(schema_file, 'r') as file:
-        schema_sql = file.read()
-    
-    for query in schema_sql.split(';'):
-        if query.strip():
-            execute_query(connection, query)
-    
-    connection.close()
+        return False
+    try:
+        upgrade(connection)
+    except RuntimeError as e:
+        print(f"スキーマの作成に失敗しました: {e}")
+        return False
+    finally:
+        connection.close()
     print(f"スキーマを作成しました。")
+    return True
 
 def main():
     parser = argparse.ArgumentParser(description="Create GLC database and schema")
     parser.add_argument("--db", required=True, help="New database name")
-    parser.add_argument("--schema", required=True, help="Schema definition file")
+    parser.add_argument("--schema", help="Ignored. The schema is created from migrations/ by glc_migrate.py")
     args = parser.parse_args()
 
+    if args.schema:
+        print("--schema は使用されません。スキーマは migrations/ のマイグレーションから作成します。")
     create_database(args.db)
-    create_schema(args.db, args.schema)
+    if not create_schema(args.db):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -1,97 +1,178 @@
 #!/usr/bin/env python3
 # glc.py
-# Version 3.5.0
-# - 処理順序の変更: glc_csr.py を3回実行し、glc_diff.py, glc_msg.py, glc_qmd.py の実行順序を調整
+# Version 3.13.0
+# - 起動時に未適用のスキーママイグレーションを確認し、--migrate の指定がなければ中断する
 
 import os
 import sys
+import time
+import signal
 import argparse
 import logging
+import threading
 from dotenv import load_dotenv
-from glc_utils import get_db_connection, is_within_time_range
-from glc_url import process_urls
+from glc_utils import get_pooled_connection, is_within_time_range
+from glc_url import process_urls, TargetCache, WRITE_ON_CHANGE
 from glc_diff import check_updates
 from glc_spn import archive_updated_urls
 from glc_msg import process_updates
 from glc_qmd import process_qmd_updates
 from glc_csr import compress_scraping_results
+from glc_budget import RunBudget
+from glc_migrate import check_schema, upgrade
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# デーモンモードの実行間隔(分)
+DAEMON_INTERVAL_MINUTES = float(os.getenv('GLC_DAEMON_INTERVAL_MINUTES', '15'))
+
 def set_log_level(debug):
     logger.setLevel(logging.DEBUG if debug else logging.INFO)
 
 
 
-def process_targets(db_name, force=False, no_toot=False, debug=False):
+def ensure_schema(db_name, migrate=False):
+    """未適用のマイグレーションがなければTrueを返します。migrateがTrueの場合は適用してからTrueを返します。"""
+    conn = get_pooled_connection(db_name)
+    if conn is None:
+        logger.error("データベース接続の取得に失敗しました。")
+        return False
+    try:
+        pending = check_schema(conn)
+        if not pending:
+            return True
+        if not migrate:
+            logger.error(f"未適用のマイグレーションがあります: {', '.join(pending)}")
+            logger.error("glc_migrate.py upgrade を実行するか、--migrate を指定してください。")
+            return False
+        upgrade(conn)
+        return True
+    except RuntimeError as e:
+        logger.error(str(e))
+        return False
+    finally:
+        conn.close()
+
+def process_targets(db_name, force=False, no_toot=False, debug=False, workers=None, per_host=None, full_sweep=False, deadline=None,
+                    target_cache=None):
+    """パイプラインを1回実行します。接続プールから借りた1つの接続を全ステージで使います。"""
     if not force and not is_within_time_range():
         logger.warning("Execution outside local time 7:00-19:00 requires --force option.")
         return
 
+    budget = RunBudget(deadline)
+    conn = None
     try:
-        conn = get_db_connection(db_name)
+        conn = get_pooled_connection(db_name)
         if conn is None:
             raise Exception("データベース接続の取得に失敗しました。")
 
-        # 1回目: スクレイピング結果の圧縮を実行
-        logger.info("スクレイピング結果の初期圧縮を開始します。")
-        compress_scraping_results(db_name)
-        logger.info("スクレイピング結果の初期圧縮が完了しました。")
+        # 1回目: スクレイピング結果の圧縮を実行 (write-on-changeでは重複行が挿入されないので不要)
+        if not WRITE_ON_CHANGE:
+            logger.info("スクレイピング結果の初期圧縮を開始します。")
+            compress_scraping_results(conn)
+            logger.info("スクレイピング結果の初期圧縮が完了しました。")
 
         # URLの処理
-        process_urls(conn)
+        fetched_ids = process_urls(conn, workers, per_host, full_sweep, budget=budget, target_cache=target_cache)
 
         # 更新の確認
-        updated_targets = check_updates(conn, debug)
+        updated_targets = check_updates(conn, debug, fetched_ids)
 
         # 2回目: スクレイピング結果の圧縮を実行
-        logger.info("スクレイピング結果の中間圧縮を開始します。")
-        compress_scraping_results(db_name)
-        logger.info("スクレイピング結果の中間圧縮が完了しました。")
+        if not WRITE_ON_CHANGE:
+            logger.info("スクレイピング結果の中間圧縮を開始します。")
+            compress_scraping_results(conn)
+            logger.info("スクレイピング結果の中間圧縮が完了しました。")
+
+        # アーカイブの作成 (前回延期したアーカイブも処理するため、更新がなくても実行)
+        archive_updated_urls(conn, updated_targets or [], budget)
 
         if updated_targets:
             logger.info(f"更新されたターゲット: {updated_targets}")
-            
-            # アーカイブの作成
-            archive_updated_urls(db_name, updated_targets)
 
             # メッセージの送信
             updated_qmd_names = [target['qmd_name'] for target in updated_targets if 'qmd_name' in target]
             if updated_qmd_names:
-                process_updates(db_name, updated_qmd_names, no_toot)
+                process_updates(conn, updated_qmd_names, no_toot)
             else:
                 logger.warning("更新されたターゲットに qmd_name が含まれていません。")
 
         # QMDファイルの生成
-        process_qmd_updates(db_name)
+        process_qmd_updates(conn, budget)
 
         # 3回目: スクレイピング結果の圧縮を実行
-        logger.info("スクレイピング結果の最終圧縮を開始します。")
-        compress_scraping_results(db_name)
-        logger.info("スクレイピング結果の最終圧縮が完了しました。")
+        if not WRITE_ON_CHANGE:
+            logger.info("スクレイピング結果の最終圧縮を開始します。")
+            compress_scraping_results(conn)
+            logger.info("スクレイピング結果の最終圧縮が完了しました。")
 
     except Exception as e:
         logger.error(f"処理中に予期せぬエラーが発生しました: {e}")
     finally:
         if conn:
             conn.close()
+        budget.report()
     
     
 
+def run_daemon(args, interval_minutes):
+    """常駐して一定間隔でパイプラインを実行します。SIGTERM・SIGINTで実行中の処理が終わってから終了します。
+
+    時間外(7:00-19:00以外)は --force を指定しない限り何もせずに次の実行時刻まで待ちます。
+    """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info("終了要求を受け付けました。実行中の処理が終わり次第終了します。")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    interval = interval_minutes * 60
+    target_cache = TargetCache()
+    logger.info(f"デーモンモードで起動しました。実行間隔: {interval_minutes}分")
+    # DB接続は接続プールに、HTTP接続は共有セッションに保持されるので、実行毎に接続し直すことはない
+    while not stop.is_set():
+        started = time.monotonic()
+        if args.force or is_within_time_range():
+            process_targets(args.db, True, args.no_toot, args.debug, args.workers, args.per_host,
+                            args.full_sweep, args.deadline, target_cache=target_cache)
+        else:
+            logger.debug("時間外のため実行しません。")
+        stop.wait(max(0, interval - (time.monotonic() - started)))
+    logger.info("デーモンモードを終了しました。")
+
 def main():
     parser = argparse.ArgumentParser(description="Webページの更新をチェックし、更新があればデータベースに記録します。")
     parser.add_argument("--force", action="store_true", help="現地時間7:00-19:00以外でも実行します。")
     parser.add_argument("--no-toot", action="store_true", help="メッセージの送信を抑制します。")
     parser.add_argument("--db", required=True, help="使用するデータベース名")
     parser.add_argument("--debug", action="store_true", help="デバッグモードを有効にします")
+    parser.add_argument("--workers", type=int, help="URL取得の並行数 (既定: 環境変数 GLC_FETCH_WORKERS または 8, 1で逐次実行)")
+    parser.add_argument("--per-host", type=int, help="ホスト毎の同時リクエスト数 (既定: 環境変数 GLC_FETCH_PER_HOST または 2)")
+    parser.add_argument("--full-sweep", action="store_true", help="次回取得時刻に関係なく全ターゲットを取得します。")
+    # 文字列の既定値にもtypeが適用されるので、GLC_RUN_DEADLINEが数値でなければargparseがエラーを報告する
+    parser.add_argument("--deadline", type=float, default=os.getenv('GLC_RUN_DEADLINE') or None,
+                        help="実行時間の上限(秒)。取得には前半の半分を使い、間に合わない取得・アーカイブ・レンダリングは次回に延期します (既定: 環境変数 GLC_RUN_DEADLINE, 未設定なら無制限)")
+    parser.add_argument("--daemon", action="store_true", help="常駐して一定間隔で実行します。時間外は --force を指定しない限り待機します。")
+    parser.add_argument("--interval", type=float, default=DAEMON_INTERVAL_MINUTES,
+                        help="デーモンモードの実行間隔(分) (既定: 環境変数 GLC_DAEMON_INTERVAL_MINUTES または 15)")
+    parser.add_argument("--migrate", action="store_true", help="未適用のスキーママイグレーションがあれば適用してから実行します。")
     args = parser.parse_args()
 
     set_log_level(args.debug)
     logger.debug("Starting main function")
-    process_targets(args.db, args.force, args.no_toot, args.debug)
+    if not ensure_schema(args.db, args.migrate):
+        sys.exit(1)
+    if args.daemon:
+        run_daemon(args, args.interval)
+        return
+    process_targets(args.db, args.force, args.no_toot, args.debug, args.workers, args.per_host, args.full_sweep, args.deadline)
     logger.debug("Finished main function")
 
 if __name__ == "__main__":
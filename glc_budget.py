@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# glc_budget.py
+# Version 1.0.1
+# - 制限していなかったdiff, messagingの配分を削除(取得・レンダリングの締め切りは変わらない)
+
+import time
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# 各ステージに配分する実行時間の割合(実行順)。使わなかった時間は後のステージに回ります。
+# 更新の確認とメッセージの送信は延期できないので制限せず、取得の後の時間を使います。
+# アーカイブはタイマーのスレッドで並行して行うため、実行全体の締め切り(deadline())を使います。
+STAGE_SHARES = (
+    ('fetch', 0.50),
+    ('render', 0.50),
+)
+
+class RunBudget:
+    """1回の実行の時間予算です。secondsがNoneの場合は制限なしで、何も後回しにしません。"""
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.start = time.monotonic()
+        self.deferred = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def deadline(self, stage=None):
+        """ステージ(省略時は実行全体)の締め切りをtime.monotonic()の値で返します。"""
+        if self.seconds is None:
+            return None
+        share = 1.0
+        if stage is not None:
+            share = 0.0
+            for name, stage_share in STAGE_SHARES:
+                share += stage_share
+                if name == stage:
+                    break
+        return self.start + self.seconds * share
+
+    def remaining(self, stage=None):
+        deadline = self.deadline(stage)
+        if deadline is None:
+            return float('inf')
+        return deadline - time.monotonic()
+
+    def can_start(self, stage, estimate=0):
+        """見積もり時間estimate(秒)の処理をステージの締め切りまでに終えられる場合にTrueを返します。"""
+        return self.remaining(stage) > estimate
+
+    def defer(self, stage, item):
+        with self.lock:
+            self.deferred[stage].append(item)
+
+    def report(self):
+        """後回しにした処理をログに出力し、ステージ名をキーとする辞書で返します。"""
+        elapsed = time.monotonic() - self.start
+        if self.seconds is not None:
+            logger.info(f"実行時間: {elapsed:.1f}秒 / 上限 {self.seconds}秒")
+        for stage, items in self.deferred.items():
+            logger.warning(f"時間予算不足のため次回に延期しました [{stage}] {len(items)}件: {', '.join(map(str, items))}")
+        return dict(self.deferred)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # glc_csr.py
-# Version 1.0.0
-# - scraping_resultsテーブルの圧縮機能
+# Version 1.4.0
+# - 重複レコードを複数テーブルのDELETEではなくidで削除(SQLiteのバックエンドに対応)
 
 import argparse
 import logging
@@ -10,61 +10,97 @@ from glc_utils import get_db_connection
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def compress_scraping_results(db_name, debug=False):
-    conn = get_db_connection(db_name)
-    if conn is None:
-        logger.error("データベース接続の取得に失敗しました。")
-        return
+def delete_results(conn, cursor, ids):
+    """scraping_resultsの行をidで削除し、削除した件数を返します。"""
+    # 大きな履歴でもロックが長くならないよう、1000件ずつ削除する
+    deleted_count = 0
+    for i in range(0, len(ids), 1000):
+        chunk = ids[i:i + 1000]
+        cursor.execute(f"DELETE FROM scraping_results WHERE id IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+        deleted_count += cursor.rowcount
+        conn.commit()
+    return deleted_count
 
+def compress_scraping_results(conn, debug=False):
+    """scraping_resultsの重複レコードを削除します。接続は呼び出し側で閉じてください。"""
     cursor = conn.cursor()
     try:
         # 削除対象のレコードを取得
         cursor.execute("""
-            SELECT t1.id, t1.target_id, t1.last_content, t1.last_update
+            SELECT t1.id, t1.target_id, t1.content_digest, t1.last_update
             FROM scraping_results t1
             INNER JOIN (
-                SELECT target_id, last_content, MIN(id) as min_id
+                SELECT target_id, content_digest, MIN(id) as min_id
                 FROM scraping_results
-                GROUP BY target_id, last_content
-            ) t2 ON t1.target_id = t2.target_id AND t1.last_content = t2.last_content
+                GROUP BY target_id, content_digest
+            ) t2 ON t1.target_id = t2.target_id AND t1.content_digest = t2.content_digest
             WHERE t1.id > t2.min_id
         """)
         to_delete = cursor.fetchall()
 
         if debug:
             for row in to_delete:
-                logger.debug(f"削除予定: ID={row[0]}, target_id={row[1]}, last_update={row[3]}, last_content={row[2][:50]}...")
+                logger.debug(f"削除予定: ID={row[0]}, target_id={row[1]}, last_update={row[3]}, content_digest={bytes(row[2]).hex()[:16]}...")
+
+        # 重複レコードの削除 (SQLiteでも実行できるよう、取得したidで削除する)
+        deleted_count = delete_results(conn, cursor, [row[0] for row in to_delete])
+        logger.info(f"圧縮完了: {deleted_count}件の重複レコードを削除しました。")
+    except Exception as e:
+        logger.error(f"圧縮中にエラーが発生しました: {str(e)}")
+        conn.rollback()
+    finally:
+        cursor.close()
 
-        # 重複レコードの削除
+def compress_consecutive_results(conn, debug=False):
+    """同じターゲットの直前の行と内容が同じ行を削除します。
+
+    write-on-change(GLC_WRITE_ON_CHANGE=1)に移行する際に一度だけ実行します。compress_scraping_resultsと
+    違い、一度変わった内容が元に戻った行(A→B→AのA)は更新として残します。
+    """
+    cursor = conn.cursor()
+    try:
         cursor.execute("""
-            DELETE t1 FROM scraping_results t1
-            INNER JOIN (
-                SELECT target_id, last_content, MIN(id) as min_id
+            SELECT id FROM (
+                SELECT id, content_digest,
+                       LAG(content_digest) OVER (PARTITION BY target_id ORDER BY id) AS previous_digest
                 FROM scraping_results
-                GROUP BY target_id, last_content
-            ) t2 ON t1.target_id = t2.target_id AND t1.last_content = t2.last_content
-            WHERE t1.id > t2.min_id
+            ) r
+            WHERE r.content_digest = r.previous_digest
         """)
-        deleted_count = cursor.rowcount
-        conn.commit()
-        logger.info(f"圧縮完了: {deleted_count}件の重複レコードを削除しました。")
+        ids = [row[0] for row in cursor.fetchall()]
+        if debug:
+            logger.debug(f"削除予定: {ids}")
+
+        deleted_count = delete_results(conn, cursor, ids)
+        logger.info(f"圧縮完了: {deleted_count}件の連続した重複レコードを削除しました。")
     except Exception as e:
         logger.error(f"圧縮中にエラーが発生しました: {str(e)}")
         conn.rollback()
     finally:
         cursor.close()
-        conn.close()
 
 def main():
     parser = argparse.ArgumentParser(description="Compress scraping_results table")
     parser.add_argument("--db", required=True, help="Database name")
     parser.add_argument("--debug", action="store_true", help="Enable debug mode")
+    parser.add_argument("--consecutive", action="store_true",
+                        help="Only delete rows identical to the previous row of the same target (one-off migration to write-on-change)")
     args = parser.parse_args()
 
     if args.debug:
         logger.setLevel(logging.DEBUG)
 
-    compress_scraping_results(args.db, args.debug)
+    conn = get_db_connection(args.db)
+    if conn is None:
+        logger.error("データベース接続の取得に失敗しました。")
+        return
+    try:
+        if args.consecutive:
+            compress_consecutive_results(conn, args.debug)
+        else:
+            compress_scraping_results(conn, args.debug)
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# glc_db.py
+# Version 1.0.0
+# - DB接続をglc_utilsから移し、環境変数 GLC_DB_BACKEND でMySQL(MariaDB)とSQLiteを切り替えられるようにする
+#
+# SQLiteのバックエンドはMySQL用に書かれたSQLを実行時に変換します。
+# - プレースホルダ %s → ?
+# - INSERT IGNORE → INSERT OR IGNORE
+# - ON DUPLICATE KEY UPDATE col = VALUES(col) → ON CONFLICT DO UPDATE SET col = excluded.col
+# - LAST_INSERT_ID() → last_insert_rowid()
+# - CREATE TABLEのENGINE・CHARSETなどのテーブルオプションは削除
+# NOW(), RAND(), YEAR(), MONTH() は同名の関数として接続毎に登録します。
+# スキーマはmigrations/sqlite/のマイグレーションで作成します。
+
+import os
+import re
+import random
+import sqlite3
+import threading
+from datetime import datetime, date
+from dotenv import load_dotenv
+
+try:
+    import mysql.connector
+    import mysql.connector.pooling
+except ImportError:
+    mysql = None
+
+# バックエンドの選択は.envにも書けるよう、他のモジュールより先に読み込む
+load_dotenv()
+
+# mysql: MySQL(MariaDB)サーバー, sqlite: GLC_SQLITE_DIR/<DB名>.sqlite3
+DB_BACKEND = os.getenv('GLC_DB_BACKEND', 'mysql').lower()
+SQLITE_DIR = os.getenv('GLC_SQLITE_DIR', '.')
+# 書き込みが競合したときに待つ時間(ミリ秒)。アーカイブのスレッドとメインスレッドが同時に書き込みます。
+SQLITE_BUSY_TIMEOUT = int(os.getenv('GLC_SQLITE_BUSY_TIMEOUT', '30000'))
+
+# どちらのバックエンドでも捕捉できるDBのエラー
+DB_ERRORS = (sqlite3.Error,) + ((mysql.connector.Error,) if mysql is not None else ())
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATETIME_VALUE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d{1,6})?$')
+
+def db_config(db_name=None):
+    return {
+        'host': os.getenv('DB_HOST', 'goudge-tc01-sid'),
+        'database': db_name,
+        'user': os.getenv('DB_USER', 'mguuji'),
+        'password': os.getenv('DB_PASSWORD')
+    }
+
+def translate_sql(sql):
+    """MySQL用のSQLをSQLiteで実行できる形に変換します。"""
+    sql = sql.replace('%s', '?')
+    sql = re.sub(r'\bINSERT\s+IGNORE\b', 'INSERT OR IGNORE', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bLAST_INSERT_ID\(\)', 'last_insert_rowid()', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\)\s*ENGINE\s*=\s*\w+[^;]*$', ')', sql.rstrip(), flags=re.IGNORECASE)
+    match = re.search(r'\bON\s+DUPLICATE\s+KEY\s+UPDATE\b', sql, flags=re.IGNORECASE)
+    if match:
+        tail = re.sub(r'\bVALUES\((\w+)\)', r'excluded.\1', sql[match.end():], flags=re.IGNORECASE)
+        sql = sql[:match.start()] + 'ON CONFLICT DO UPDATE SET' + tail
+    return sql
+
+def to_db_value(value):
+    # MySQLのDATETIMEと同じく、タイムゾーンは変換せずに捨てて秒までを保存する
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None).strftime(DATETIME_FORMAT)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, bytearray):
+        return bytes(value)
+    return value
+
+def from_db_value(value):
+    # 集計関数の結果には宣言型がないので、DATETIMEの書式の文字列はすべてdatetimeに戻す
+    if isinstance(value, str) and DATETIME_VALUE.match(value):
+        return datetime.fromisoformat(value)
+    return value
+
+def sql_now():
+    return datetime.now().strftime(DATETIME_FORMAT)
+
+def sql_year(value):
+    return int(value[:4]) if value else None
+
+def sql_month(value):
+    return int(value[5:7]) if value else None
+
+class SQLiteCursor:
+    """mysql.connectorのカーソルと同じ使い方ができるSQLiteのカーソルです。"""
+
+    def __init__(self, cursor, dictionary=False):
+        self.cursor = cursor
+        self.dictionary = dictionary
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(translate_sql(sql), tuple(to_db_value(value) for value in params or ()))
+
+    def executemany(self, sql, seq_of_params):
+        self.cursor.executemany(translate_sql(sql), [tuple(to_db_value(value) for value in params) for params in seq_of_params])
+
+    def convert(self, row):
+        if row is None:
+            return None
+        values = tuple(from_db_value(value) for value in row)
+        if self.dictionary:
+            return dict(zip((column[0] for column in self.cursor.description), values))
+        return values
+
+    def fetchone(self):
+        return self.convert(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self.convert(row) for row in self.cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self.convert(row) for row in self.cursor.fetchmany(size)]
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def close(self):
+        self.cursor.close()
+
+class SQLiteConnection:
+    """mysql.connectorの接続と同じ使い方ができるSQLiteの接続です。"""
+
+    def __init__(self, db_name):
+        self.database = db_name
+        path = os.path.join(SQLITE_DIR, f"{db_name}.sqlite3")
+        # アーカイブのスレッドは自分で接続を開くが、念のためスレッドの制限は外しておく
+        self.conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT / 1000, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}")
+        self.conn.create_function('NOW', 0, sql_now)
+        self.conn.create_function('RAND', 0, random.random)
+        self.conn.create_function('YEAR', 1, sql_year)
+        self.conn.create_function('MONTH', 1, sql_month)
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self.conn.cursor(), dictionary)
+
+    def executescript(self, sql):
+        self.conn.executescript(sql)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self.conn.close()
+
+def get_db_connection(db_name=None):
+    """データベースへの接続を取得します。"""
+    try:
+        if DB_BACKEND == 'sqlite':
+            return SQLiteConnection(db_name)
+        if mysql is None:
+            print("mysql-connector-pythonがインストールされていません。GLC_DB_BACKEND=sqliteを指定するとSQLiteを使用します。")
+            return None
+        connection = mysql.connector.connect(**db_config(db_name))
+        return connection
+    except DB_ERRORS as e:
+        print(f"データベース接続エラー: {e}")
+        return None
+
+# 接続プールの大きさ。glc.pyのメインスレッドとアーカイブのスレッドが同時に借ります。
+DB_POOL_SIZE = int(os.getenv('GLC_DB_POOL_SIZE', '4'))
+
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+
+def get_db_pool(db_name):
+    """データベース毎の接続プールを返します。初回の呼び出しで作成します。"""
+    with _db_pools_lock:
+        if db_name not in _db_pools:
+            _db_pools[db_name] = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name=f"glc_{db_name}",
+                pool_size=DB_POOL_SIZE,
+                pool_reset_session=True,
+                **db_config(db_name)
+            )
+        return _db_pools[db_name]
+
+def get_pooled_connection(db_name):
+    """接続プールから接続を借ります。close()で接続はプールに返却されます。
+
+    返却時にセッションがリセットされるので、前の利用者のトランザクションは持ち越されません。
+    プールが空いていない場合は、プール外の接続を返します。
+    SQLiteは接続を開く費用が小さいので、プールを使わずに新しい接続を返します。
+    """
+    if DB_BACKEND == 'sqlite' or mysql is None:
+        return get_db_connection(db_name)
+    try:
+        return get_db_pool(db_name).get_connection()
+    except mysql.connector.errors.PoolError as e:
+        print(f"接続プールに空きがないため、プール外の接続を使用します: {e}")
+        return get_db_connection(db_name)
+    except mysql.connector.Error as e:
+        print(f"データベース接続エラー: {e}")
+        return None
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # glc_diff.py
-# Version 2.3.0
-# - check_lastmodifiedフラグを除去し、全てのターゲットで同じ更新判定ロジックを使用
+# Version 2.8.0
+# - change_eventsへの記録時にtarget_statsを更新
 
 import json
 import logging
@@ -12,39 +12,96 @@ logger = logging.getLogger(__name__)
 
 
 
-def check_updates(conn, debug=False):
+def fetch_latest_pairs(conn, target_ids=None):
+    """ターゲット毎に最新と1つ前のscraping_resultsを1回のクエリで取得します。
+
+    行が1件しかないターゲットはprevious_digest, previous_updateがNoneになります。
+    target_idsを指定した場合はそのターゲットだけを取得します。
+    """
+    where = ""
+    params = ()
+    if target_ids is not None:
+        target_ids = sorted(set(target_ids))
+        if not target_ids:
+            return []
+        where = f"WHERE target_id IN ({', '.join(['%s'] * len(target_ids))})"
+        params = tuple(target_ids)
+
     cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"""
+            WITH ranked AS (
+                SELECT id, target_id, content_digest, last_update,
+                       ROW_NUMBER() OVER (PARTITION BY target_id ORDER BY id DESC) AS rn
+                FROM scraping_results
+                {where}
+            )
+            SELECT t.id, t.url, t.qmd_name, t.check_lastmodified,
+                   r1.id AS latest_id, r1.content_digest AS latest_digest, r1.last_update AS latest_update,
+                   r2.content_digest AS previous_digest, r2.last_update AS previous_update
+            FROM scraping_targets t
+            JOIN ranked r1 ON r1.target_id = t.id AND r1.rn = 1
+            LEFT JOIN ranked r2 ON r2.target_id = t.id AND r2.rn = 2
+            ORDER BY t.id
+        """, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def record_change_events(conn, rows):
+    """更新と判定した最新行をchange_eventsに記録し、target_statsを更新します。同じ行の2回目以降の記録は無視されます。"""
+    if not rows:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT IGNORE INTO change_events (target_id, result_id, last_update, detected_at)
+            VALUES (%s, %s, %s, NOW())
+        """, [(row['id'], row['latest_id'], row['latest_update']) for row in rows])
+        # 対象のターゲットだけchange_eventsから集計し直すので、同じ行を2回記録しても回数はずれない
+        target_ids = sorted({row['id'] for row in rows})
+        cursor.execute(f"""
+            INSERT INTO target_stats (target_id, update_count, first_change_at, last_change_at)
+            SELECT target_id, COUNT(*), MIN(last_update), MAX(last_update)
+            FROM change_events
+            WHERE target_id IN ({', '.join(['%s'] * len(target_ids))})
+            GROUP BY target_id
+            ON DUPLICATE KEY UPDATE
+              update_count = VALUES(update_count),
+              first_change_at = VALUES(first_change_at),
+              last_change_at = VALUES(last_change_at)
+        """, tuple(target_ids))
+        conn.commit()
+    finally:
+        cursor.close()
+
+def check_updates(conn, debug=False, target_ids=None):
+    """最新2件のscraping_resultsを比較して更新されたターゲットを返します。
+
+    target_idsを指定した場合はそのターゲットだけを判定します。条件付きGETで304が
+    返されたターゲットや取得に失敗したターゲットは新しい行が挿入されないため、
+    glc.pyからは今回挿入されたtarget_idのみを渡します。
+    ダイジェストの比較はPython側で行います。
+    更新はchange_eventsにも記録します。check_lastmodified=TRUEのターゲットは最初の行も
+    Last-Modifiedの日時を表すのでchange_eventsに記録しますが、戻り値には含めません。
+    """
     updated_targets = []
 
     try:
-        cursor.execute("SELECT id, url, qmd_name FROM scraping_targets")
-        targets = cursor.fetchall()
-
-        for target in targets:
-            target_id = target['id']
-            target_url = target['url']
-            target_qmd_name = target['qmd_name']
-            
-            cursor.execute("""
-                SELECT last_content, last_update
-                FROM scraping_results
-                WHERE target_id = %s
-                ORDER BY id DESC
-                LIMIT 2
-            """, (target_id,))
-            
-            results = cursor.fetchall()
-            
-            if len(results) == 2:
-                latest = results[0]
-                previous = results[1]
-                
-                if previous['last_content'] is not None and latest['last_content'] != previous['last_content']:
-                    updated_targets.append({
-                        "id": target_id,
-                        "url": target_url,
-                        "qmd_name": target_qmd_name
-                    })
+        events = []
+        for row in fetch_latest_pairs(conn, target_ids):
+            if row['previous_digest'] is None:
+                if row['check_lastmodified']:
+                    events.append(row)
+                continue
+            if row['latest_digest'] != row['previous_digest']:
+                events.append(row)
+                updated_targets.append({
+                    "id": row['id'],
+                    "url": row['url'],
+                    "qmd_name": row['qmd_name']
+                })
+        record_change_events(conn, events)
 
         if debug:
             logger.debug(f"[glc_diff.py] Updated targets: {json.dumps(updated_targets, indent=2)}")
@@ -52,12 +109,10 @@ def check_updates(conn, debug=False):
 
     except Exception as e:
         logger.error(f"[glc_diff.py] 更新チェック中にエラーが発生しました: {e}")
-    finally:
-        cursor.close()
 
     return updated_targets
-    
-    
+
+
 
 def main(db_name, debug=False):
     conn = get_db_connection(db_name)
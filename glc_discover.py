@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# glc_discover.py
+# Version 1.0.0
+# - RSS/Atomフィードやsitemap.xmlの更新日時から、取得が必要なターゲットだけを選ぶ
+
+import logging
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin
+from glc_utils import fetch_response, read_body, normalize_url
+from glc_host import host_of
+
+logger = logging.getLogger(__name__)
+
+# フィード・サイトマップの本文の上限(バイト)
+DISCOVERY_MAX_BYTES = 5 * 1024 * 1024
+
+# 1件分の要素(sitemapの<url>, RSSの<item>, Atomの<entry>)と、更新日時を表す子要素(優先順)
+ENTRY_TAGS = ('url', 'item', 'entry')
+DATE_TAGS = ('lastmod', 'updated', 'pubDate', 'date', 'published')
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+def entry_link(entry, base_url):
+    for child in entry:
+        name = local_name(child.tag)
+        if name == 'loc' and child.text:
+            return urljoin(base_url, child.text.strip())
+        if name == 'link':
+            # Atomは<link rel="alternate" href="...">、RSSは<link>URL</link>
+            href = child.get('href')
+            if href and child.get('rel', 'alternate') == 'alternate':
+                return urljoin(base_url, href.strip())
+            if not href and child.text and child.text.strip():
+                return urljoin(base_url, child.text.strip())
+    return None
+
+def entry_date(entry):
+    dates = {}
+    for child in entry:
+        name = local_name(child.tag)
+        if name in DATE_TAGS and child.text and child.text.strip() and name not in dates:
+            dates[name] = child.text.strip()
+    for name in DATE_TAGS:
+        if name in dates:
+            return dates[name][:64]
+    return None
+
+def parse_discovery(body, base_url):
+    """フィード・サイトマップを解析し、正規化したURLをキー、更新日時の文字列(なければNone)を値とする辞書を返します。
+
+    更新日時は比較のためだけに使うので、文字列のまま保持します。
+    サイトマップインデックス(<sitemapindex>)の子サイトマップはたどりません。
+    """
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError as e:
+        logger.warning(f"フィード・サイトマップの解析に失敗しました ({base_url}): {e}")
+        return None
+    entries = {}
+    for element in root.iter():
+        if local_name(element.tag) not in ENTRY_TAGS:
+            continue
+        link = entry_link(element, base_url)
+        if link:
+            # フィードは新しい順に並ぶので、同じURLは最初の項目を使う
+            entries.setdefault(normalize_url(link), entry_date(element))
+    return entries
+
+def fetch_discovery(url, user_agent, limiter=None):
+    """フィード・サイトマップを取得して解析します。失敗した場合はNoneを返します。"""
+    def fetch():
+        response = fetch_response(url, user_agent)
+        if response is None:
+            return None
+        return read_body(response, DISCOVERY_MAX_BYTES)
+
+    if limiter is None:
+        body = fetch()
+    else:
+        with limiter.slot(url):
+            body = fetch()
+    if body is None:
+        return None
+    return parse_discovery(body, url)
+
+def filter_by_discovery(targets, states, user_agent, executor, limiter=None, breaker=None):
+    """discovery_urlが設定されたターゲットのうち、取得の必要がないものを除きます。
+
+    (取得するターゲット, スキップしたターゲット, target_idをキーとする新しい更新日時の辞書) を返します。
+    フィードに載っていて、更新日時が前回取得時(fetch_state.discovery_lastmod)と同じターゲットだけをスキップします。
+    フィードに載っていない・更新日時がない・フィードを取得できなかったターゲットは通常どおり取得します。
+    """
+    sources = {}
+    for target in targets:
+        if target.get('discovery_url'):
+            sources.setdefault(target['discovery_url'], []).append(target)
+    if not sources:
+        return targets, [], {}
+
+    futures = {}
+    for url in sources:
+        if breaker is not None and not breaker.allow(host_of(url)):
+            continue
+        futures[url] = executor.submit(fetch_discovery, url, user_agent, limiter)
+
+    skipped = []
+    lastmods = {}
+    for url, source_targets in sources.items():
+        entries = None
+        if url in futures:
+            try:
+                entries = futures[url].result()
+            except Exception as e:
+                logger.error(f"フィード・サイトマップの取得中にエラーが発生しました ({url}): {e}")
+        if entries is None:
+            logger.warning(f"フィード・サイトマップを使用できないため、通常どおり取得します: {url} ({len(source_targets)}件)")
+            continue
+        for target in source_targets:
+            key = normalize_url(target['url'])
+            if key not in entries or entries[key] is None:
+                continue
+            lastmod = entries[key]
+            if lastmod == states.get(target['id'], {}).get('discovery_lastmod'):
+                skipped.append(target)
+            else:
+                lastmods[target['id']] = lastmod
+        logger.info(f"フィード・サイトマップ {url}: {len(source_targets)}件中 更新あり{sum(1 for t in source_targets if t['id'] in lastmods)}件")
+
+    skipped_ids = {target['id'] for target in skipped}
+    return [target for target in targets if target['id'] not in skipped_ids], skipped, lastmods
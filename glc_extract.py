@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# glc_extract.py
+# Version 1.3.0
+# - LxmlExtractorはhtml.parserと木の形が同じ文書だけを扱う(終了タグの補完や入れ子の修正がある文書はbs4で抽出する)
+# - LxmlExtractorで空白だけの文字列をBeautifulSoupと同じく'\n'または' 'に置き換える
+# - html.parserと解釈が異なる文書(textarea, CDATA, 未知の文字参照, </html>の後の内容など)はbs4で抽出する
+
+import os
+import re
+import codecs
+import logging
+import threading
+from html.parser import HTMLParser
+from html.entities import html5 as html5_entities
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:
+    etree = None
+    lxml_html = None
+
+logger = logging.getLogger(__name__)
+
+# 既定の抽出バックエンド。scraping_targets.extractor が設定されたターゲットはそちらを優先します。
+DEFAULT_EXTRACTOR = os.getenv('GLC_EXTRACTOR', 'bs4')
+
+# BeautifulSoupのHTMLTreeBuilderが専用の文字列クラスで保持するタグ。
+# これらのタグの中の文字列は、外側の要素の .text には含まれません。
+STRING_CONTAINERS = ('rt', 'rp', 'style', 'script', 'template')
+
+XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+# BeautifulSoupは空白だけの文字列を、改行を含めば'\n'、含まなければ' 'に置き換えます。
+# pre, textareaの中では置き換えません。空白とみなすのはASCIIの空白文字だけです。
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+PRESERVE_WHITESPACE_TAGS = ('pre', 'textarea')
+
+def collapse_whitespace(text, preserve=False):
+    if preserve or text.strip(ASCII_SPACES):
+        return text
+    return '\n' if '\n' in text else ' '
+
+# html.parserとlibxml2で解釈が異なり、同じテキストにならない記述。
+# これらを含む文書はLxmlExtractorでは扱わず、BS4Extractorで抽出します。
+UNSUPPORTED_MARKUP = re.compile(
+    r'<textarea\b|<plaintext\b|<!\[CDATA\['
+    # libxml2はtitle, xmpなどの中身をタグとして解釈せず、xmpなどでは文字参照も展開しない
+    r'|<(title)\b[^>]*>(?:(?!</title)[^<])*(?!</title)(?:<|$)'
+    r'|<(xmp|iframe|noembed|noframes)\b[^>]*>(?:(?!</\2)[^<&])*(?!</\2)(?:[<&]|$)'
+    # </html>の後の内容(コメントを除く)はlibxml2では捨てられる
+    r'|</html\s*>(?:\s|<!--.*?-->)*(?!\s|<!--)[^\s]',
+    re.IGNORECASE | re.DOTALL
+)
+SCRIPT_OR_STYLE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+TAG_MARKUP = re.compile(r'<[A-Za-z/!?][^>]*>')
+QUOTED_VALUE = re.compile(r'"[^"]*"|\'[^\']*\'')
+ENTITY_REFERENCE = re.compile(r'&(#?)([A-Za-z0-9]*)(;?)')
+
+def has_ambiguous_reference(text):
+    """html.parserとlibxml2で展開結果が異なる文字参照があればTrueを返します。"""
+    for match in ENTITY_REFERENCE.finditer(text):
+        numeric, name, semicolon = match.groups()
+        if numeric:
+            # ;で終わらない数値文字参照は、後続の文字によって解釈が異なる
+            if not (semicolon and re.fullmatch(r'[0-9]+|[xX][0-9A-Fa-f]+', name)):
+                return True
+        elif name and name[0].isalpha() and name + semicolon not in html5_entities:
+            # 未知の名前、または;を省略できない名前の;の省略
+            return True
+    return False
+
+# html.parserが作る木の形を求めるための字句。コメント、script・styleの中身、宣言・処理命令は要素として扱いません。
+OUTLINE_TOKEN = re.compile(
+    r'<!--.*?-->|<(script|style)\b[^>]*>.*?</\1\s*>|<(/?)([A-Za-z][^\s/>]*)([^>]*)>|<![^>]*>|<\?[^>]*>',
+    re.IGNORECASE | re.DOTALL
+)
+
+def html_parser_outline(content):
+    """BeautifulSoup(html.parser)が作る木を (深さ, タグ名) の先行順のリストで返します。
+
+    空白以外の文字列は '#text' として含めます。BeautifulSoupは終了タグを補わず、
+    終了タグは開いている同名の要素までを閉じ、対応する要素がなければ無視します。
+    閉じていないscript, styleがある場合はNoneを返します。
+    """
+    outline = []
+    stack = []
+    position = 0
+    for match in OUTLINE_TOKEN.finditer(content):
+        if content[position:match.start()].strip(ASCII_SPACES):
+            outline.append((len(stack), '#text'))
+        position = match.end()
+        if match.group(1):
+            outline.append((len(stack), match.group(1).lower()))
+            continue
+        if match.group(3) is None:
+            continue
+        name = match.group(3).lower()
+        if match.group(2):
+            if name in stack:
+                del stack[len(stack) - 1 - stack[::-1].index(name):]
+            continue
+        if name in ('script', 'style'):
+            return None
+        outline.append((len(stack), name))
+        if name not in VOID_ELEMENTS and not match.group(4).endswith('/'):
+            stack.append(name)
+    if content[position:].strip(ASCII_SPACES):
+        outline.append((len(stack), '#text'))
+    return outline
+
+def lxml_outline(doc):
+    """lxmlの木をhtml_parser_outlineと同じ形式で返します。"""
+    outline = []
+
+    def visit(element, depth):
+        outline.append((depth, element.tag))
+        if element.tag in ('script', 'style'):
+            return
+        if element.text and element.text.strip(ASCII_SPACES):
+            outline.append((depth + 1, '#text'))
+        for child in element:
+            if isinstance(child.tag, str):
+                visit(child, depth + 1)
+            if child.tail and child.tail.strip(ASCII_SPACES):
+                outline.append((depth + 1, '#text'))
+
+    visit(doc, 0)
+    return outline
+
+# 終了タグを持たない要素
+VOID_ELEMENTS = ('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr')
+
+class BS4Extractor:
+    """BeautifulSoup(html.parser)による抽出。従来のscrape_contentと同じ処理です。"""
+    name = 'bs4'
+
+    def available(self):
+        return True
+
+    def supports(self, content):
+        return True
+
+    def parse(self, content):
+        return BeautifulSoup(content, 'html.parser')
+
+    def extract(self, doc, tag, tag_id, tag_class):
+        if tag_id:
+            elements = doc.find_all(tag, id=tag_id)
+        elif tag_class:
+            classes = tag_class.split()
+            elements = doc.find_all(tag, class_=lambda x: x and all(c in x.split() for c in classes))
+        else:
+            elements = doc.find_all(tag)
+        return [element.text.strip() for element in elements]
+
+    def preview(self, doc):
+        return doc.prettify()[:500]
+
+class LxmlExtractor:
+    """lxml(libxml2)による抽出。BS4Extractorと同じテキストになるように .text の規則を再現します。"""
+    name = 'lxml'
+
+    def available(self):
+        return lxml_html is not None
+
+    def __init__(self):
+        # supports()の判定と解析した木を、同じ文書のparse()と次のsupports()で使い回す(スレッド毎)
+        self.parsed = threading.local()
+
+    def supports(self, content):
+        if getattr(self.parsed, 'content', None) is not content:
+            doc = None
+            supported = self.check_markup(content)
+            if supported:
+                doc = self.parse_document(content)
+                # libxml2は終了タグの補完(<p>の中の<div>, 閉じていない<li>など)や入れ子の修正、
+                # html・bodyの追加を行うので、html.parserと木の形が同じ文書だけを扱う
+                expected = html_parser_outline(content)
+                supported = doc is not None and expected is not None and lxml_outline(doc) == expected
+            self.parsed.content, self.parsed.doc, self.parsed.supported = content, doc, supported
+        return self.parsed.supported
+
+    def check_markup(self, content):
+        """html.parserとlibxml2で解釈が異なる記述がなければTrueを返します。"""
+        # libxml2は改行コードCRLFをLFに正規化し、NULを置換するため、html.parserとハッシュが一致しなくなる
+        if '\r' in content or '\x00' in content:
+            return False
+        if UNSUPPORTED_MARKUP.search(content):
+            return False
+        # 閉じていない引用符があると、タグの終わりの解釈が異なる
+        for tag in TAG_MARKUP.findall(content):
+            if '"' in QUOTED_VALUE.sub('', tag) or "'" in QUOTED_VALUE.sub('', tag):
+                return False
+        # 属性値とscript, styleの中の&は抽出するテキストに影響しないので、それ以外の部分だけを調べる
+        return not has_ambiguous_reference(TAG_MARKUP.sub('', SCRIPT_OR_STYLE.sub('', content)))
+
+    def parse(self, content):
+        if getattr(self.parsed, 'content', None) is content and self.parsed.doc is not None:
+            return self.parsed.doc
+        return self.parse_document(content)
+
+    def parse_document(self, content):
+        # 文字列として渡す場合、XML宣言のencoding指定はlxmlでエラーになる
+        content = XML_DECLARATION.sub('', content, count=1)
+        try:
+            return lxml_html.document_fromstring(content)
+        except etree.ParserError:
+            return None
+
+    def extract(self, doc, tag, tag_id, tag_class):
+        if doc is None:
+            return []
+        classes = tag_class.split() if tag_class else []
+        texts = []
+        for element in doc.iter(tag or etree.Element):
+            if tag_id:
+                if element.get('id') != tag_id:
+                    continue
+            elif tag_class:
+                values = (element.get('class') or '').split()
+                if not values or not all(c in values for c in classes):
+                    continue
+            texts.append(self.element_text(element).strip())
+        return texts
+
+    def element_text(self, element):
+        """BeautifulSoupの Tag.text と同じ規則で要素内のテキストを連結します。"""
+        wanted = element.tag if element.tag in STRING_CONTAINERS else None
+        current = wanted
+        if current is None:
+            for ancestor in element.iterancestors():
+                if ancestor.tag in STRING_CONTAINERS:
+                    current = ancestor.tag
+                    break
+        preserve = element.tag in PRESERVE_WHITESPACE_TAGS or any(
+            ancestor.tag in PRESERVE_WHITESPACE_TAGS for ancestor in element.iterancestors())
+
+        parts = []
+        if element.text and current == wanted:
+            parts.append(collapse_whitespace(element.text, preserve))
+        stack = [(iter(element), current, element, preserve)]
+        while stack:
+            children, current, node, preserve = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                # 要素の後ろのテキスト(tail)は親要素に属する
+                if stack and node.tail and stack[-1][1] == wanted:
+                    parts.append(collapse_whitespace(node.tail, stack[-1][3]))
+                continue
+            if isinstance(child.tag, str):
+                inner = child.tag if child.tag in STRING_CONTAINERS else current
+                inner_preserve = preserve or child.tag in PRESERVE_WHITESPACE_TAGS
+                if child.text and inner == wanted:
+                    parts.append(collapse_whitespace(child.text, inner_preserve))
+                stack.append((iter(child), inner, child, inner_preserve))
+            elif child.tail and current == wanted:
+                # コメントや処理命令の本文は含めず、後ろのテキストだけを含める
+                parts.append(collapse_whitespace(child.tail, preserve))
+        return ''.join(parts)
+
+    def preview(self, doc):
+        if doc is None:
+            return ''
+        return etree.tostring(doc, encoding='unicode', pretty_print=True)[:500]
+
+EXTRACTORS = {
+    BS4Extractor.name: BS4Extractor(),
+    LxmlExtractor.name: LxmlExtractor(),
+}
+
+def select_extractor(name=None, content=None):
+    """抽出バックエンドを選択します。使用できない場合はbs4にフォールバックします。"""
+    name = name or DEFAULT_EXTRACTOR
+    extractor = EXTRACTORS.get(name)
+    if extractor is None:
+        logger.warning(f"不明な抽出バックエンドです: {name}。bs4を使用します。")
+        return EXTRACTORS['bs4']
+    if not extractor.available():
+        logger.warning(f"抽出バックエンド {name} が利用できません。bs4を使用します。")
+        return EXTRACTORS['bs4']
+    if content is not None and not extractor.supports(content):
+        return EXTRACTORS['bs4']
+    return extractor
+
+class ElementCloseWatcher(HTMLParser):
+    """受信中のHTMLを逐次解析し、tag_idの要素が閉じられたことを検出します。
+
+    html.parser(BeautifulSoupと同じトークナイザ)で開始・終了タグだけを追跡します。
+    要素が閉じた時点までの本文を解析すれば、その要素の抽出結果は全文を解析した場合と同じです。
+    """
+
+    def __init__(self, tag, tag_id, encoding=None):
+        super().__init__(convert_charrefs=False)
+        self.tag = tag
+        self.tag_id = tag_id
+        self.open_tag = None
+        self.depth = 0
+        self.closed = False
+        # タグの検出だけが目的なので、文字化けは問題にならない
+        try:
+            decoder_class = codecs.getincrementaldecoder(encoding or 'utf-8')
+        except LookupError:
+            decoder_class = codecs.getincrementaldecoder('utf-8')
+        self.decoder = decoder_class(errors='replace')
+
+    def feed_bytes(self, chunk):
+        """チャンクを解析し、要素が閉じていればTrueを返します。"""
+        if not self.closed:
+            self.feed(self.decoder.decode(chunk))
+        return self.closed
+
+    def handle_starttag(self, tag, attrs):
+        if self.closed:
+            return
+        if self.depth:
+            if tag == self.open_tag:
+                self.depth += 1
+        elif (not self.tag or tag == self.tag) and dict(attrs).get('id') == self.tag_id:
+            self.open_tag = tag
+            self.depth = 1
+            if tag in VOID_ELEMENTS:
+                self.closed = True
+
+    def handle_endtag(self, tag):
+        if self.depth and not self.closed and tag == self.open_tag:
+            self.depth -= 1
+            if self.depth == 0:
+                self.closed = True
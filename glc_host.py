@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# glc_host.py
+# Version 1.0.0
+# - ホスト毎の連続失敗回数を記録し、応答しないホストへのリクエストを止めるサーキットブレーカー
+
+import os
+import logging
+import threading
+from datetime import timedelta
+from urllib.parse import urlsplit
+from glc_sched import utcnow
+
+logger = logging.getLogger(__name__)
+
+# 連続失敗がこの回数に達したホストは、その実行の残りと次のretry_afterまでスキップします
+BREAKER_THRESHOLD = int(os.getenv('GLC_BREAKER_THRESHOLD', '3'))
+# スキップする期間は BACKOFF_BASE_MINUTES から失敗毎に倍になり、BACKOFF_MAX_MINUTES で頭打ちになります
+BACKOFF_BASE_MINUTES = int(os.getenv('GLC_BACKOFF_BASE_MINUTES', '60'))
+BACKOFF_MAX_MINUTES = int(os.getenv('GLC_BACKOFF_MAX_MINUTES', str(7 * 24 * 60)))
+
+def host_of(url):
+    return (urlsplit(url).hostname or '').lower()
+
+def backoff(failures):
+    """連続失敗回数に応じたスキップ期間を返します。閾値未満ならNoneを返します。"""
+    if failures < BREAKER_THRESHOLD:
+        return None
+    minutes = BACKOFF_BASE_MINUTES * (2 ** (failures - BREAKER_THRESHOLD))
+    return timedelta(minutes=min(minutes, BACKOFF_MAX_MINUTES))
+
+class HostCircuitBreaker:
+    """ホスト毎のサーキットブレーカー。ワーカースレッドから呼び出せます。
+
+    host_failuresテーブルの内容で初期化し、実行中の成功・失敗を記録してsaveで書き戻します。
+    """
+
+    def __init__(self, rows=None, now=None):
+        self.now = now or utcnow()
+        self.hosts = {row['host']: dict(row) for row in (rows or [])}
+        self.changed = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, conn, now=None):
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT host, consecutive_failures, last_failure_at, retry_after, last_error FROM host_failures")
+            return cls(cursor.fetchall(), now)
+        finally:
+            cursor.close()
+
+    def allow(self, host):
+        """ホストへのリクエストを許可する場合にTrueを返します。"""
+        with self.lock:
+            row = self.hosts.get(host)
+            if row is None:
+                return True
+            retry_after = row.get('retry_after')
+            return retry_after is None or retry_after <= self.now
+
+    def record_success(self, host):
+        with self.lock:
+            row = self.hosts.get(host)
+            if row is None or not row['consecutive_failures']:
+                return
+            row['consecutive_failures'] = 0
+            row['retry_after'] = None
+            self.changed.add(host)
+        logger.info(f"ホストが復旧しました: {host}")
+
+    def record_failure(self, host, error):
+        with self.lock:
+            row = self.hosts.setdefault(host, {'host': host, 'consecutive_failures': 0})
+            row['consecutive_failures'] += 1
+            row['last_failure_at'] = utcnow()
+            row['last_error'] = str(error)[:1000]
+            delay = backoff(row['consecutive_failures'])
+            # 実行中に閾値へ達した場合は、retry_afterが現在時刻より後になるので以後の取得がスキップされる
+            row['retry_after'] = row['last_failure_at'] + delay if delay else None
+            self.changed.add(host)
+            failures = row['consecutive_failures']
+        if delay:
+            logger.warning(f"ホスト {host} は{failures}回連続で失敗したため、{delay}の間スキップします: {error}")
+
+    def save(self, conn):
+        """変更のあったホストの状態をhost_failuresテーブルに保存します。"""
+        if not self.changed:
+            return
+        rows = [
+            (host, self.hosts[host]['consecutive_failures'], self.hosts[host].get('last_failure_at'),
+             self.hosts[host].get('retry_after'), self.hosts[host].get('last_error'))
+            for host in self.changed
+        ]
+        cursor = conn.cursor()
+        try:
+            cursor.executemany("""
+                INSERT INTO host_failures (host, consecutive_failures, last_failure_at, retry_after, last_error)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE consecutive_failures = VALUES(consecutive_failures),
+                    last_failure_at = VALUES(last_failure_at), retry_after = VALUES(retry_after),
+                    last_error = VALUES(last_error)
+            """, rows)
+            conn.commit()
+            self.changed.clear()
+        except Exception as e:
+            logger.error(f"host_failuresの更新中にエラーが発生しました: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
@@ -1,30 +1,16 @@
 #!/usr/bin/env python3
 # glc_log.py
-# Version 1.0.0
-# - Initial version: View action_logs in syslog or JSON format
+# Version 1.1.0
+# - --hosts オプションでhost_failures(ホスト毎の連続失敗とバックオフ)を表示
 
 import argparse
 import json
-import mysql.connector
 from dotenv import load_dotenv
-import os
+from glc_db import get_db_connection, DB_ERRORS
 from datetime import datetime
 
 load_dotenv()
 
-def get_db_connection(db_name):
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            database=db_name,
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD')
-        )
-        return connection
-    except mysql.connector.Error as e:
-        print(f"データベース接続エラー: {e}")
-        return None
-
 def fetch_logs(db_name):
     conn = get_db_connection(db_name)
     if conn is None:
@@ -40,31 +26,62 @@ def fetch_logs(db_name):
         """)
         logs = cursor.fetchall()
         return logs
-    except mysql.connector.Error as e:
+    except DB_ERRORS as e:
         print(f"ログの取得中にエラーが発生しました: {e}")
         return []
     finally:
         cursor.close()
         conn.close()
 
+def fetch_host_failures(db_name):
+    conn = get_db_connection(db_name)
+    if conn is None:
+        return []
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT host, consecutive_failures, last_failure_at, retry_after, last_error
+            FROM host_failures
+            WHERE consecutive_failures > 0
+            ORDER BY consecutive_failures DESC, host
+        """)
+        return cursor.fetchall()
+    except DB_ERRORS as e:
+        print(f"ホスト障害情報の取得中にエラーが発生しました: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def format_host_syslog(row):
+    timestamp = row['last_failure_at'].strftime("%b %d %H:%M:%S") if row['last_failure_at'] else "-"
+    retry_after = row['retry_after'].strftime("%Y-%m-%d %H:%M:%S UTC") if row['retry_after'] else "-"
+    return f"{timestamp} GLC[host]: {row['host']} FAILURES={row['consecutive_failures']} RETRY_AFTER={retry_after} - {row['last_error']}"
+
 def format_syslog(log):
     timestamp = log['action_time'].strftime("%b %d %H:%M:%S")
     status = "SUCCESS" if log['status'] else "FAILURE"
     return f"{timestamp} GLC[{log['id']}]: {log['action_type'].upper()} {status} - URL: {log['url']} - {log['message']}"
 
-def display_logs(logs, json_format=False):
+def display_logs(logs, json_format=False, formatter=format_syslog):
     if json_format:
         print(json.dumps(logs, default=str, indent=2))
     else:
         for log in logs:
-            print(format_syslog(log))
+            print(formatter(log))
 
 def main():
     parser = argparse.ArgumentParser(description="View action logs in syslog or JSON format")
     parser.add_argument("--db", required=True, help="Database name to use")
     parser.add_argument("--json", action="store_true", help="Display logs in JSON format")
+    parser.add_argument("--hosts", action="store_true", help="Display hosts that are currently failing and their backoff")
     args = parser.parse_args()
 
+    if args.hosts:
+        display_logs(fetch_host_failures(args.db), args.json, format_host_syslog)
+        return
+
     logs = fetch_logs(args.db)
     display_logs(logs, args.json)
 
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# glc_migrate.py
+# Version 1.1.0
+# - SQLiteのバックエンドではmigrations/sqlite/のマイグレーションを適用する
+#
+# マイグレーションは NNNN_説明.sql または NNNN_説明.py のファイルです。
+# - .sql はセミコロンで区切られた文を順に実行します(文字列やコメント中のセミコロンは区切りとみなしません)。
+# - .py は upgrade(conn) 関数を実行します。
+# MariaDBのDDLは暗黙にコミットされ、途中で失敗すると一部だけ適用された状態になるため、
+# マイグレーションは IF NOT EXISTS などで何度実行しても同じ結果になるように書いてください。
+# 失敗した場合はschema_versionに記録せずに中断するので、修正後にupgradeを再実行できます。
+# SQLite(GLC_DB_BACKEND=sqlite)のスキーマはmigrations/sqlite/で管理します。番号はMySQL用と揃え、
+# 0006_baseline.sqlがMySQL用の0001から0006までを適用した状態に相当します。
+
+import os
+import re
+import sys
+import argparse
+import logging
+import importlib.util
+from dotenv import load_dotenv
+from glc_db import get_db_connection, DB_BACKEND
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+if DB_BACKEND == 'sqlite':
+    MIGRATIONS_DIR = os.path.join(MIGRATIONS_DIR, 'sqlite')
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+
+# DDLがメタデータロックを待つ時間(秒)。稼働中のテーブルで長いトランザクションがあるときに、
+# 後続のクエリを巻き込んで止めてしまわないよう、短い時間で諦めてエラーにします。
+LOCK_WAIT_TIMEOUT = int(os.getenv('GLC_MIGRATION_LOCK_WAIT_TIMEOUT', '10'))
+
+def list_migrations(directory=MIGRATIONS_DIR):
+    """(番号, 名前, パス) のリストを番号順に返します。"""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), filename, os.path.join(directory, filename)))
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"マイグレーションの番号が重複しています: {directory}")
+    return migrations
+
+def split_statements(sql):
+    """SQLを文に分割します。引用符の中とコメントの中のセミコロンは区切りとみなしません。"""
+    statements = []
+    current = []
+    quote = None
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if quote:
+            current.append(char)
+            if char == '\\' and quote != '`' and i + 1 < len(sql):
+                current.append(sql[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in ("'", '"', '`'):
+            quote = char
+            current.append(char)
+        elif sql.startswith('--', i) or char == '#':
+            end = sql.find('\n', i)
+            i = len(sql) if end == -1 else end
+            continue
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = len(sql) if end == -1 else end + 2
+            continue
+        elif char == ';':
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+def ensure_version_table(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+              version INT PRIMARY KEY,
+              name VARCHAR(255) NOT NULL,
+              applied_at DATETIME NOT NULL
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+def applied_versions(conn):
+    ensure_version_table(conn)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT version FROM schema_version")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def pending_migrations(conn, directory=MIGRATIONS_DIR):
+    applied = applied_versions(conn)
+    return [migration for migration in list_migrations(directory) if migration[0] not in applied]
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location(f"glc_migration_{os.path.basename(path)[:-3]}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def apply_migration(conn, version, name, path):
+    cursor = conn.cursor()
+    try:
+        if DB_BACKEND != 'sqlite':
+            cursor.execute(f"SET SESSION lock_wait_timeout = {LOCK_WAIT_TIMEOUT}")
+        if path.endswith('.sql') and DB_BACKEND == 'sqlite':
+            # トリガーのBEGIN ... END内のセミコロンを区切らないよう、SQLite自身に分割させる
+            with open(path, 'r', encoding='utf-8') as f:
+                conn.executescript(f.read())
+        elif path.endswith('.sql'):
+            with open(path, 'r', encoding='utf-8') as f:
+                statements = split_statements(f.read())
+            for statement in statements:
+                cursor.execute(statement)
+            conn.commit()
+        else:
+            load_module(path).upgrade(conn)
+        cursor.execute(
+            "INSERT INTO schema_version (version, name, applied_at) VALUES (%s, %s, NOW())",
+            (version, name)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def upgrade(conn, target=None, directory=MIGRATIONS_DIR):
+    """未適用のマイグレーションを番号順に適用し、適用した数を返します。失敗した場合は例外を送出します。"""
+    count = 0
+    for version, name, path in pending_migrations(conn, directory):
+        if target is not None and version > target:
+            break
+        logger.info(f"マイグレーションを適用します: {name}")
+        try:
+            apply_migration(conn, version, name, path)
+        except Exception as e:
+            raise RuntimeError(f"マイグレーション {name} の適用に失敗しました: {e}") from e
+        count += 1
+    if count:
+        logger.info(f"{count}件のマイグレーションを適用しました。")
+    else:
+        logger.info("スキーマは最新です。")
+    return count
+
+def status(conn, directory=MIGRATIONS_DIR):
+    """(番号, 名前, 適用日時またはNone) のリストを返します。"""
+    ensure_version_table(conn)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT version, applied_at FROM schema_version")
+        applied = dict(cursor.fetchall())
+    finally:
+        cursor.close()
+    return [(version, name, applied.get(version)) for version, name, _ in list_migrations(directory)]
+
+def check_schema(conn, directory=MIGRATIONS_DIR):
+    """未適用のマイグレーションの名前のリストを返します。glc.pyの起動時に使います。"""
+    return [name for _, name, _ in pending_migrations(conn, directory)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply or inspect numbered schema migrations")
+    parser.add_argument("command", choices=['upgrade', 'status'], help="upgrade: apply pending migrations, status: list migrations")
+    parser.add_argument("--db", required=True, help="Database name")
+    parser.add_argument("--to", type=int, help="Stop after this migration number (upgrade only)")
+    args = parser.parse_args()
+
+    conn = get_db_connection(args.db)
+    if conn is None:
+        logger.error("データベース接続の取得に失敗しました。")
+        sys.exit(2)
+    try:
+        if args.command == 'upgrade':
+            try:
+                upgrade(conn, args.to)
+            except RuntimeError as e:
+                logger.error(str(e))
+                sys.exit(1)
+        else:
+            for version, name, applied_at in status(conn):
+                print(f"{version:04d}\t{applied_at or '(未適用)'}\t{name}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # glc_msg.py
-# Version 7.0.0
-# - 更新検出されたURLのqmd_nameに基づいてqmd_name_viewを参照し、メッセージを作成
+# Version 7.3.0
+# - qmd_name毎のビューの代わりに、更新されたqmd_nameの最新2件を1回のクエリで取得
 
 import os
 import yaml
@@ -28,6 +28,30 @@ def load_msg_config():
 
 MSG_CONFIG = load_msg_config()
 
+# ログイン済みのクライアント。送信に失敗した場合は破棄して次回作り直します。
+_clients = {}
+
+def get_mastodon_client():
+    if 'mastodon' not in _clients:
+        _clients['mastodon'] = Mastodon(
+            client_id=os.getenv('MASTODON_CLIENT_ID'),
+            client_secret=os.getenv('MASTODON_CLIENT_SECRET'),
+            access_token=os.getenv('MASTODON_ACCESS_TOKEN'),
+            api_base_url=os.getenv('MASTODON_BASE_URL')
+        )
+    return _clients['mastodon']
+
+def get_twitter_client():
+    if 'twitter' not in _clients:
+        client = TwitterClient('en-US')
+        client.login(
+            auth_info_1=os.getenv('TWITTER_USERNAME'),
+            auth_info_2=os.getenv('TWITTER_EMAIL'),
+            password=os.getenv('TWITTER_PASSWORD')
+        )
+        _clients['twitter'] = client
+    return _clients['twitter']
+
 def format_message(target_info):
     return MSG_CONFIG['Message']['format'].format(
         time=target_info['last_update'].strftime("%Y年%m月%d日 %H時%M分(日本時間)"),
@@ -42,15 +66,10 @@ def send_toot(message, no_toot=False):
         return
 
     try:
-        mastodon = Mastodon(
-            client_id=os.getenv('MASTODON_CLIENT_ID'),
-            client_secret=os.getenv('MASTODON_CLIENT_SECRET'),
-            access_token=os.getenv('MASTODON_ACCESS_TOKEN'),
-            api_base_url=os.getenv('MASTODON_BASE_URL')
-        )
-        status = mastodon.status_post(message)
+        status = get_mastodon_client().status_post(message)
         logger.info(f"トゥートの送信に成功しました。投稿URL: {status['url']}")
     except Exception as e:
+        _clients.pop('mastodon', None)
         logger.error(f"トゥートの送信に失敗しました: {str(e)}, 送信内容: {message}")
 
 #def send_bluesky(message, no_toot=False):
@@ -72,38 +91,52 @@ def send_tweet(message, no_toot=False):
         return
 
     try:
-        client = TwitterClient('en-US')
-        client.login(
-            auth_info_1=os.getenv('TWITTER_USERNAME'),
-            auth_info_2=os.getenv('TWITTER_EMAIL'),
-            password=os.getenv('TWITTER_PASSWORD')
-        )
-        tweet = client.create_tweet(text=message)
+        tweet = get_twitter_client().create_tweet(text=message)
         logger.info(f"Twitterへの投稿に成功しました。投稿ID: {tweet.id}")
     except Exception as e:
+        _clients.pop('twitter', None)
         logger.error(f"Twitterへの投稿に失敗しました: {str(e)}, 送信内容: {message}")
 
-def process_updates(db_name, updated_qmd_names, no_toot=False):
-    conn = get_db_connection(db_name)
-    if conn is None:
-        logger.error("データベース接続の取得に失敗しました。")
-        return
+def fetch_latest_events(conn, qmd_names):
+    """qmd_name毎に最新2件の更新(change_events)を1回のクエリで取得し、qmd_nameをキーとする辞書で返します。"""
+    qmd_names = sorted(set(qmd_names))
+    if not qmd_names:
+        return {}
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"""
+            WITH ranked AS (
+                SELECT t.qmd_name, t.owner, t.ownerurl, t.title, t.url, e.last_update,
+                       ROW_NUMBER() OVER (PARTITION BY e.target_id ORDER BY e.last_update DESC, e.id DESC) AS rn
+                FROM change_events e
+                JOIN scraping_targets t ON t.id = e.target_id
+                WHERE t.qmd_name IN ({', '.join(['%s'] * len(qmd_names))})
+            )
+            SELECT qmd_name, owner, ownerurl, title, url, last_update
+            FROM ranked
+            WHERE rn <= 2
+            ORDER BY qmd_name, rn
+        """, tuple(qmd_names))
+        events = {}
+        for row in cursor.fetchall():
+            events.setdefault(row['qmd_name'], []).append(row)
+        return events
+    finally:
+        cursor.close()
 
+def process_updates(conn, updated_qmd_names, no_toot=False):
+    """更新されたqmd_nameのメッセージを送信します。接続は呼び出し側で閉じてください。"""
     try:
-        cursor = conn.cursor(dictionary=True)
-        
+        events = fetch_latest_events(conn, updated_qmd_names)
         for qmd_name in updated_qmd_names:
-            # qmd_name_viewから最新の2行を取得
-            cursor.execute(f"SELECT * FROM {qmd_name}_view ORDER BY last_update DESC LIMIT 2")
-            rows = cursor.fetchall()
-            
+            rows = events.get(qmd_name, [])
             if len(rows) < 2:
-                logger.info(f"{qmd_name}_view に十分なデータがありません。スキップします。")
+                logger.info(f"{qmd_name} の更新履歴に十分なデータがありません。スキップします。")
                 continue
-            
+
             latest = rows[0]
             previous = rows[1]
-            
+
             # 最新行と最最新行が異なる場合にメッセージを送信
             if latest != previous:
                 message = format_message(latest)
@@ -111,13 +144,10 @@ def process_updates(db_name, updated_qmd_names, no_toot=False):
                 send_bluesky(message, no_toot)
                 send_tweet(message, no_toot)
             else:
-                logger.info(f"{qmd_name}_view の最新2行に変更がありません。メッセージは送信しません。")
+                logger.info(f"{qmd_name} の最新2件に変更がありません。メッセージは送信しません。")
 
     except Exception as e:
         logger.error(f"[glc_msg.py] 更新処理中にエラーが発生: {str(e)}")
-    finally:
-        cursor.close()
-        conn.close()
 
 if __name__ == "__main__":
     import argparse
@@ -127,4 +157,11 @@ if __name__ == "__main__":
     parser.add_argument("--no-toot", action="store_true", help="Don't actually send messages, just print them")
     args = parser.parse_args()
 
-    process_updates(args.db, args.qmd_names, args.no_toot)
+    conn = get_db_connection(args.db)
+    if conn is None:
+        logger.error("データベース接続の取得に失敗しました。")
+    else:
+        try:
+            process_updates(conn, args.qmd_names, args.no_toot)
+        finally:
+            conn.close()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # glc_qmd.py
-# Version 1.0.2
-# - QMDファイル生成後にquarto renderを実行する機能を追加
+# Version 1.2.0
+# - 呼び出し側の接続を受け取るように変更
 
 import yaml
 import sys
@@ -76,15 +76,36 @@ def render_qmd(qmd_filename):
     except subprocess.CalledProcessError as e:
         logger.error(f"{qmd_filename} のレンダリング中にエラーが発生しました: {e}")
 
-def process_qmd_updates(db_name):
-    conn = get_db_connection(db_name)
-    if conn is None:
-        logger.error("データベース接続の取得に失敗しました。")
-        return
+# 1ファイルのレンダリングにかかる時間の見積もり(秒)
+RENDER_ESTIMATE = int(os.getenv('GLC_RENDER_ESTIMATE', '10'))
 
+def write_qmd(qmd_filename, qmd_content):
+    """QMDファイルを書き込みます。内容が前回と同じ場合はFalseを返します。"""
+    try:
+        with open(qmd_filename, 'r', encoding='utf-8') as f:
+            if f.read() == qmd_content:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(qmd_filename, 'w', encoding='utf-8') as f:
+        f.write(qmd_content)
+    logger.info(f"{qmd_filename} ファイルを生成しました。")
+    return True
+
+def render_pages(changed, unchanged, budget=None):
+    """内容が変わったファイルをすべてレンダリングし、変更のないファイルは時間予算の範囲で再レンダリングします。"""
+    for qmd_filename in changed:
+        render_qmd(qmd_filename)
+    for qmd_filename in unchanged:
+        if budget is not None and not budget.can_start('render', RENDER_ESTIMATE):
+            budget.defer('render', qmd_filename)
+            continue
+        render_qmd(qmd_filename)
+
+def process_qmd_updates(conn, budget=None):
+    """QMDファイルを生成してレンダリングします。接続は呼び出し側で閉じてください。"""
+    cursor = conn.cursor(dictionary=True)
     try:
-        cursor = conn.cursor(dictionary=True)
-        
         # 更新されたターゲットを取得
         cursor.execute("SELECT * FROM updated_targets_view")
         updated_targets = cursor.fetchall()
@@ -93,31 +114,36 @@ def process_qmd_updates(db_name):
         cursor.execute("SELECT * FROM qmd_view")
         qmd_targets = cursor.fetchall()
 
+        changed = []
+        unchanged = []
+
         # 個別のQMDファイルを生成
         for target in qmd_targets:
             qmd_filename = f"{target['qmd_name']}.qmd"
             qmd_content = generate_qmd_content(updated_targets, target['qmd_name'], target['title'], target['owner'])
-            with open(qmd_filename, 'w', encoding='utf-8') as f:
-                f.write(qmd_content)
-            logger.info(f"{qmd_filename} ファイルを生成しました。")
-            render_qmd(qmd_filename)
+            (changed if write_qmd(qmd_filename, qmd_content) else unchanged).append(qmd_filename)
 
         # トップページを生成
         top_page_content = generate_top_page_content(updated_targets, qmd_targets)
-        with open(TOP_PAGE_FILENAME, 'w', encoding='utf-8') as f:
-            f.write(top_page_content)
-        logger.info(f"{TOP_PAGE_FILENAME} ファイルを生成しました。")
-        render_qmd(TOP_PAGE_FILENAME)
+        (changed if write_qmd(TOP_PAGE_FILENAME, top_page_content) else unchanged).append(TOP_PAGE_FILENAME)
+
+        render_pages(changed, unchanged, budget)
 
     except Exception as e:
         logger.error(f"QMD更新処理中にエラーが発生: {str(e)}")
     finally:
         cursor.close()
-        conn.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate QMD files for updated targets")
     parser.add_argument("--db", required=True, help="Database name")
     args = parser.parse_args()
 
-    process_qmd_updates(args.db)
+    conn = get_db_connection(args.db)
+    if conn is None:
+        logger.error("データベース接続の取得に失敗しました。")
+    else:
+        try:
+            process_qmd_updates(conn)
+        finally:
+            conn.close()
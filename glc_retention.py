@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# glc_retention.py
+# Version 1.1.0
+# - transfer_runsも保持期間の対象にする
+
+import os
+import gzip
+import json
+import argparse
+import logging
+from datetime import date
+from dotenv import load_dotenv
+from glc_utils import get_db_connection
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# テーブル毎の保持方針。monthsは保持する月数(今月を含まない)で、0の場合は削除しません。
+# keep_latestはターゲット毎に必ず残す最新の行数です。glc_diffとwrite-on-changeが最新2行を参照するため、
+# scraping_resultsは古くても最新2行を残します。
+RETENTION_POLICIES = {
+    'scraping_results': {
+        'time_column': 'last_update',
+        'months': int(os.getenv('GLC_RETENTION_SCRAPING_RESULTS_MONTHS', '24')),
+        'keep_latest': 2,
+    },
+    'action_logs': {
+        'time_column': 'action_time',
+        'months': int(os.getenv('GLC_RETENTION_ACTION_LOGS_MONTHS', '12')),
+        'keep_latest': 0,
+    },
+    'transfer_runs': {
+        'time_column': 'run_at',
+        'months': int(os.getenv('GLC_RETENTION_TRANSFER_RUNS_MONTHS', '12')),
+        'keep_latest': 0,
+    },
+}
+
+ARCHIVE_DIR = os.getenv('GLC_RETENTION_ARCHIVE_DIR', 'archive')
+BATCH_SIZE = int(os.getenv('GLC_RETENTION_BATCH_SIZE', '1000'))
+
+def month_start(year, month):
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return date(year, month, 1)
+
+def retention_cutoff(months, today=None):
+    """保持期間より古い行の境界(その月の1日)を返します。この日付より前の行が対象です。"""
+    today = today or date.today()
+    return month_start(today.year, today.month - months)
+
+def to_json_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).hex()
+    return str(value)
+
+def protected_ids(cursor, table, keep_latest):
+    if not keep_latest:
+        return set()
+    cursor.execute(f"""
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY target_id ORDER BY id DESC) AS rn
+            FROM {table}
+        ) ranked
+        WHERE rn <= %s
+    """, (keep_latest,))
+    return {row['id'] for row in cursor.fetchall()}
+
+def expired_months(cursor, table, time_column, cutoff):
+    cursor.execute(f"""
+        SELECT YEAR({time_column}) AS year, MONTH({time_column}) AS month, COUNT(*) AS count
+        FROM {table}
+        WHERE {time_column} < %s
+        GROUP BY year, month
+        ORDER BY year, month
+    """, (cutoff,))
+    return cursor.fetchall()
+
+def archive_month(conn, table, time_column, start, end, protected, archive_dir, dry_run=False):
+    """1か月分の行を書き出して削除し、削除した(dry_runの場合は対象となる)行数を返します。
+
+    書き出したバッチをファイルに反映してから削除・コミットするので、途中で中断しても行が失われることはありません
+    (中断した場合、次回の実行で同じ行がもう一度書き出されることがあります)。
+    archive_dirがNoneの場合は書き出さずに削除します。
+    """
+    cursor = conn.cursor(dictionary=True)
+    path = None
+    archive = None
+    if archive_dir is not None and not dry_run:
+        os.makedirs(os.path.join(archive_dir, table), exist_ok=True)
+        path = os.path.join(archive_dir, table, f"{start:%Y-%m}.jsonl.gz")
+        # 追記すると別のgzipメンバーになるが、gzip・zcatではそのまま連続して読める
+        archive = gzip.open(path, 'at', encoding='utf-8')
+    count = 0
+    last_id = 0
+    try:
+        while True:
+            cursor.execute(f"""
+                SELECT * FROM {table}
+                WHERE id > %s AND {time_column} >= %s AND {time_column} < %s
+                ORDER BY id LIMIT %s
+            """, (last_id, start, end, BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            rows = [row for row in rows if row['id'] not in protected]
+            if not rows:
+                continue
+            count += len(rows)
+            if dry_run:
+                continue
+            if archive is not None:
+                for row in rows:
+                    archive.write(json.dumps(row, ensure_ascii=False, default=to_json_value) + "\n")
+                archive.flush()
+            ids = [row['id'] for row in rows]
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", tuple(ids))
+            conn.commit()
+    finally:
+        if archive is not None:
+            archive.close()
+        cursor.close()
+    if path and count:
+        logger.info(f"{table} {start:%Y-%m}: {count}件を {path} に書き出して削除しました。")
+    elif count:
+        logger.info(f"{table} {start:%Y-%m}: {count}件{'が対象です' if dry_run else 'を削除しました'}。")
+    return count
+
+def apply_retention(conn, table, months=None, archive_dir=ARCHIVE_DIR, dry_run=False):
+    """テーブルの保持期間を過ぎた行を月単位で書き出して削除し、行数の合計を返します。"""
+    policy = RETENTION_POLICIES[table]
+    months = policy['months'] if months is None else months
+    if months <= 0:
+        logger.info(f"{table}: 保持期間が設定されていないため削除しません。")
+        return 0
+
+    cutoff = retention_cutoff(months)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        protected = protected_ids(cursor, table, policy['keep_latest'])
+        months_found = expired_months(cursor, table, policy['time_column'], cutoff)
+    finally:
+        cursor.close()
+
+    logger.info(f"{table}: {cutoff} より前の行が対象です ({len(months_found)}か月分)")
+    total = 0
+    for row in months_found:
+        start = month_start(row['year'], row['month'])
+        end = month_start(row['year'], row['month'] + 1)
+        total += archive_month(conn, table, policy['time_column'], start, end, protected, archive_dir, dry_run)
+    logger.info(f"{table}: 合計{total}件{'が対象です' if dry_run else 'を処理しました'}。")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive and prune old rows of scraping_results, action_logs and transfer_runs by month")
+    parser.add_argument("--db", required=True, help="Database name")
+    parser.add_argument("--table", choices=sorted(RETENTION_POLICIES), action='append',
+                        help="Table to process (repeatable, default: all)")
+    parser.add_argument("--months", type=int,
+                        help="Months to keep, overriding GLC_RETENTION_<TABLE>_MONTHS (0 keeps everything)")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR,
+                        help="Directory for <table>/<YYYY-MM>.jsonl.gz files (default: GLC_RETENTION_ARCHIVE_DIR or ./archive)")
+    parser.add_argument("--no-archive", action="store_true", help="Delete without writing archive files")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many rows would be processed")
+    args = parser.parse_args()
+
+    conn = get_db_connection(args.db)
+    if conn is None:
+        logger.error("データベース接続の取得に失敗しました。")
+        return
+    try:
+        for table in args.table or sorted(RETENTION_POLICIES):
+            apply_retention(conn, table, args.months, None if args.no_archive else args.archive_dir, args.dry_run)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
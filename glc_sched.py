@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# glc_sched.py
+# Version 1.1.0
+# - 更新回数をtarget_statsから読み、集計を取得したターゲットに限定する
+#   (保持期間によるscraping_resultsの削除で更新頻度の推定がずれないようにする)
+
+import os
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from glc_utils import get_db_connection
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 取得間隔の下限と上限(分)
+MIN_INTERVAL_MINUTES = int(os.getenv('GLC_MIN_INTERVAL_MINUTES', '60'))
+MAX_INTERVAL_MINUTES = int(os.getenv('GLC_MAX_INTERVAL_MINUTES', '1440'))
+# 推定した更新間隔の間に何回取得するか
+POLLS_PER_CHANGE = float(os.getenv('GLC_POLLS_PER_CHANGE', '4'))
+
+def utcnow():
+    """DBのDATETIME列と比較するためのタイムゾーンなしのUTC現在時刻を返します。"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def load_change_stats(conn, target_ids):
+    """target_idsのターゲット毎の (記録された内容の数, 最初の記録時刻) を返します。
+
+    更新回数はtarget_stats(change_eventsの集計)から読みます。change_eventsは保持期間による
+    削除の対象外なので、glc_retentionでscraping_resultsの古い行を削除しても回数は減りません。
+    check_lastmodified=TRUEのターゲットは最初の行も更新として記録されているので、そのまま内容の数です。
+    最初の記録時刻は、残っているscraping_resultsの最初の行と最初の更新のうち早い方です。
+    """
+    if not target_ids:
+        return {}
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"""
+            SELECT t.id AS target_id, t.check_lastmodified, s.update_count, s.first_change_at,
+                   (SELECT MIN(r.last_update) FROM scraping_results r WHERE r.target_id = t.id) AS first_result_at
+            FROM scraping_targets t
+            LEFT JOIN target_stats s ON s.target_id = t.id
+            WHERE t.id IN ({', '.join(['%s'] * len(target_ids))})
+        """, tuple(target_ids))
+        stats = {}
+        for row in cursor.fetchall():
+            times = [value for value in (row['first_result_at'], row['first_change_at']) if value is not None]
+            if not times:
+                continue
+            versions = (row['update_count'] or 0) + (0 if row['check_lastmodified'] else 1)
+            stats[row['target_id']] = (versions, min(times))
+        return stats
+    finally:
+        cursor.close()
+
+def next_interval(versions, first_seen, now):
+    """更新履歴から次回までの取得間隔を計算します。
+
+    内容が変わった回数を数えるので、(内容の数 - 1) が観測した更新回数です。
+    観測期間を (更新回数 + 1) で割った値を平均更新間隔とし、その間に POLLS_PER_CHANGE 回取得します。
+    """
+    minimum = timedelta(minutes=MIN_INTERVAL_MINUTES)
+    maximum = timedelta(minutes=MAX_INTERVAL_MINUTES)
+    if not versions or first_seen is None:
+        return minimum
+    if first_seen.tzinfo is not None:
+        first_seen = first_seen.astimezone(timezone.utc).replace(tzinfo=None)
+    span = max(now - first_seen, timedelta(0))
+    interval = span / versions / POLLS_PER_CHANGE
+    return min(max(interval, minimum), maximum)
+
+def due_targets(targets, states, now):
+    """next_check_atを過ぎた(または未設定の)ターゲットだけを、取得が遅れている順に返します。"""
+    due = []
+    for target in targets:
+        next_check_at = states.get(target['id'], {}).get('next_check_at')
+        if next_check_at is None or next_check_at <= now:
+            due.append((next_check_at or datetime.min, target))
+    # 時間予算で取得を打ち切る場合に、最も遅れているターゲットから取得されるようにする
+    due.sort(key=lambda item: item[0])
+    return [target for _, target in due]
+
+def schedule_targets(conn, target_ids, now=None):
+    """取得したターゲットの次回取得時刻をfetch_stateに保存します。"""
+    if not target_ids:
+        return
+    now = now or utcnow()
+    stats = load_change_stats(conn, target_ids)
+    rows = []
+    for target_id in target_ids:
+        versions, first_seen = stats.get(target_id, (0, None))
+        rows.append((target_id, now + next_interval(versions, first_seen, now)))
+
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO fetch_state (target_id, next_check_at)
+            VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE next_check_at = VALUES(next_check_at)
+        """, rows)
+        conn.commit()
+        logger.debug(f"{len(rows)}件のターゲットの次回取得時刻を更新しました。")
+    except Exception as e:
+        logger.error(f"次回取得時刻の更新中にエラーが発生しました: {e}")
+        conn.rollback()
+    finally:
+        cursor.close()
+
+def show_schedule(conn):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT t.id, t.url, f.next_check_at
+            FROM scraping_targets t
+            LEFT JOIN fetch_state f ON t.id = f.target_id
+            ORDER BY f.next_check_at
+        """)
+        for row in cursor.fetchall():
+            print(f"{row['next_check_at'] or '(未設定)'}\t{row['id']}\t{row['url']}")
+    finally:
+        cursor.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or reset the per-target polling schedule")
+    parser.add_argument("--db", required=True, help="Database name")
+    parser.add_argument("--reset", action="store_true", help="Clear next_check_at so every target is fetched on the next run")
+    args = parser.parse_args()
+
+    conn = get_db_connection(args.db)
+    if conn is None:
+        logger.error("データベース接続の取得に失敗しました。")
+        return
+    try:
+        if args.reset:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE fetch_state SET next_check_at = NULL")
+            conn.commit()
+            cursor.close()
+            logger.info("全ターゲットの次回取得時刻をリセットしました。")
+        else:
+            show_schedule(conn)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,32 @@
 #!/usr/bin/env python3
 # glc_spn.py
+# Version 1.4.1
+# - 3回失敗したアーカイブはpending_archivesから削除し、次回以降は再試行しない
 
 import logging
 import savepagenow
 import time
 from queue import Queue
 from threading import Timer
-from glc_utils import get_db_connection, get_random_user_agent
+from glc_utils import get_pooled_connection, get_random_user_agent
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# アーカイブの間隔(秒)
+ARCHIVE_INTERVAL = 20
+
 class URLArchiver:
-    def __init__(self, db_name):
+    """URLを間隔をあけて順にアーカイブします。DBへの書き込みはタイマーのスレッドで、接続プールから借りた接続で行います。"""
+
+    def __init__(self, db_name, deadline=None):
         self.db_name = db_name
         self.queue = Queue()
         self.last_archive_time = 0
         self.processing = False
         self.retry_count = {}
+        # time.monotonic()の値。これを過ぎたら残りのURLはpending_archivesに保存して終了する
+        self.deadline = deadline
 
     def add_url(self, target_id, url):
         self.queue.put((target_id, url))
@@ -32,10 +41,31 @@ class URLArchiver:
 
         self.processing = True
         current_time = time.time()
-        wait_time = max(0, 20 - (current_time - self.last_archive_time))
+        wait_time = max(0, ARCHIVE_INTERVAL - (current_time - self.last_archive_time))
+
+        if self.deadline is not None and time.monotonic() + wait_time > self.deadline:
+            self.defer_remaining()
+            self.processing = False
+            return
 
         Timer(wait_time, self._archive_url).start()
 
+    def defer_remaining(self):
+        """キューに残っているURLをpending_archivesに保存します。"""
+        pending = []
+        while not self.queue.empty():
+            pending.append(self.queue.get())
+        if pending:
+            conn = get_pooled_connection(self.db_name)
+            if conn is None:
+                logger.error("[glc_spn.py] データベース接続の取得に失敗しました。")
+                return
+            try:
+                save_pending_archives(conn, pending)
+            finally:
+                conn.close()
+            logger.warning(f"[glc_spn.py] 時間予算不足のため{len(pending)}件のアーカイブを次回に延期しました。")
+
     def _archive_url(self):
         target_id, url = self.queue.get()
         try:
@@ -49,14 +79,33 @@ class URLArchiver:
                     self.queue.put((target_id, url))
                 else:
                     logger.error(f"[glc_spn.py] アーカイブ失敗: {url}, 3回のリトライ後も失敗")
+                    # 延期分として残っていると毎回の実行で再試行され、新しいアーカイブの枠を使い続けるので削除する
+                    self.drop_pending(target_id)
         except Exception as e:
             logger.error(f"[glc_spn.py] アーカイブ処理中にエラーが発生: {url}, エラー: {str(e)}")
 
         self.last_archive_time = time.time()
         self.process_next()
 
+    def drop_pending(self, target_id):
+        """アーカイブをあきらめたターゲットをpending_archivesから削除します。"""
+        conn = get_pooled_connection(self.db_name)
+        if conn is None:
+            logger.error("[glc_spn.py] データベース接続の取得に失敗しました。")
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM pending_archives WHERE target_id = %s", (target_id,))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"[glc_spn.py] 延期したアーカイブの削除に失敗しました: {str(e)}")
+            conn.rollback()
+        finally:
+            cursor.close()
+            conn.close()
+
     def archive_and_save(self, target_id, url):
-        conn = get_db_connection(self.db_name)
+        conn = get_pooled_connection(self.db_name)
         if conn is None:
             logger.error("[glc_spn.py] データベース接続の取得に失敗しました。")
             return None
@@ -75,6 +124,16 @@ class URLArchiver:
                 VALUES (%s, %s, NOW())
                 ON DUPLICATE KEY UPDATE archive_url = VALUES(archive_url), created_at = NOW()
             """, (target_id, archived_url))
+            # ページ生成でarchive_urlsを検索しなくて済むよう、最新の更新に記録しておく
+            cursor.execute("""
+                UPDATE change_events SET archive_url = %s
+                WHERE id = (SELECT MAX(id) FROM change_events WHERE target_id = %s)
+            """, (archived_url, target_id))
+            cursor.execute("""
+                INSERT INTO target_stats (target_id, last_archived_at) VALUES (%s, NOW())
+                ON DUPLICATE KEY UPDATE last_archived_at = VALUES(last_archived_at)
+            """, (target_id,))
+            cursor.execute("DELETE FROM pending_archives WHERE target_id = %s", (target_id,))
             conn.commit()
             return archived_url
         except Exception as e:
@@ -84,10 +143,63 @@ class URLArchiver:
             if conn:
                 conn.close()
 
-def archive_updated_urls(db_name, updated_targets):
-    archiver = URLArchiver(db_name)
+def save_pending_archives(conn, pending):
+    """アーカイブを延期したURLをpending_archivesに保存します。"""
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO pending_archives (target_id, url, created_at)
+            VALUES (%s, %s, NOW())
+            ON DUPLICATE KEY UPDATE url = VALUES(url)
+        """, pending)
+        conn.commit()
+    except Exception as e:
+        logger.error(f"[glc_spn.py] 延期したアーカイブの保存に失敗しました: {str(e)}")
+        conn.rollback()
+    finally:
+        cursor.close()
+
+def load_pending_archives(conn):
+    """前回までに延期したアーカイブを (target_id, url) のリストで返します。"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT target_id, url FROM pending_archives ORDER BY created_at")
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"[glc_spn.py] 延期したアーカイブの取得に失敗しました: {str(e)}")
+        return []
+    finally:
+        cursor.close()
+
+def archive_updated_urls(conn, updated_targets, budget=None):
+    """更新されたターゲットと、前回までに延期したターゲットをアーカイブします。
+
+    budgetを渡した場合、実行全体の締め切りまでに処理できる件数だけをキューに入れ、
+    残りはpending_archivesに保存して次回の実行に回します。
+    アーカイブ自体はタイマーのスレッドで行うので、connとは別に接続プールの接続を使います。
+    """
+    queue = load_pending_archives(conn)
+    queued_ids = {target_id for target_id, _ in queue}
     for target in updated_targets:
-        archiver.add_url(target['id'], target['url'])
+        if target['id'] not in queued_ids:
+            queue.append((target['id'], target['url']))
+            queued_ids.add(target['id'])
+    if not queue:
+        return
+
+    deadline = budget.deadline() if budget is not None else None
+    if budget is not None and deadline is not None:
+        capacity = max(0, int(budget.remaining() // ARCHIVE_INTERVAL))
+        if len(queue) > capacity:
+            deferred = queue[capacity:]
+            queue = queue[:capacity]
+            save_pending_archives(conn, deferred)
+            for _, url in deferred:
+                budget.defer('archive', url)
+
+    archiver = URLArchiver(conn.database, deadline)
+    for target_id, url in queue:
+        archiver.add_url(target_id, url)
 
 if __name__ == "__main__":
     import argparse
@@ -100,4 +212,9 @@ if __name__ == "__main__":
         {"id": 1, "url": "https://example.com"},
         {"id": 2, "url": "https://example.org"},
     ]
-    archive_updated_urls(args.db, test_targets)
+    conn = get_pooled_connection(args.db)
+    if conn is not None:
+        try:
+            archive_updated_urls(conn, test_targets)
+        finally:
+            conn.close()
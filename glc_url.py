@@ -1,72 +1,498 @@
 #!/usr/bin/env python3
 # glc_url.py
+# Version 1.18.0
+# - 転送量はaction_logsに書かず、ターゲット毎の累計をtransfer_statsに、実行毎の合計をtransfer_runsに記録する
+# - rebaseline_targetsのターゲットは、次回の取得で最新のscraping_resultsのダイジェストを置き換える(更新として扱わない)
 
+import os
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
-from glc_utils import get_initial_content, calculate_sha3_512
+from urllib.parse import urlsplit
+from glc_utils import get_initial_content, get_group_content, calculate_digest, normalize_url, NOT_MODIFIED
+from glc_sched import utcnow, due_targets, schedule_targets
+from glc_host import HostCircuitBreaker, host_of
+from glc_discover import filter_by_discovery
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def process_target(conn, session, target):
+# 並行取得のワーカー数とホスト毎の同時リクエスト数の上限
+DEFAULT_MAX_WORKERS = int(os.getenv('GLC_FETCH_WORKERS', '8'))
+DEFAULT_MAX_PER_HOST = int(os.getenv('GLC_FETCH_PER_HOST', '2'))
+# 取得結果を1トランザクションで書き込む件数
+WRITE_BATCH_SIZE = int(os.getenv('GLC_WRITE_BATCH_SIZE', '100'))
+# 1の場合、内容が変わったときだけscraping_resultsに挿入する。0にすると毎回挿入し、圧縮で重複を削除する従来の動作になります。
+WRITE_ON_CHANGE = os.getenv('GLC_WRITE_ON_CHANGE', '1') == '1'
+
+class HostLimiter:
+    """ホスト毎に同時に実行するリクエスト数を制限します。"""
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max(1, max_per_host)
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def slot(self, url):
+        host = urlsplit(url).hostname or ''
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.semaphores[host]
+
+class TargetCache:
+    """scraping_targetsの内容を実行間で保持し、追加・変更・削除された行だけを反映します。
+
+    変更の検出にはscraping_targets.updated_at(ON UPDATE CURRENT_TIMESTAMP)を使います。
+    同じ秒の更新を取りこぼさないよう、前回の最大値と等しい行も読み直します。
+    """
+
+    def __init__(self):
+        self.targets = {}
+        self.last_updated = None
+
+    def refresh(self, conn):
+        """最新のターゲット一覧をid順に返します。"""
+        cursor = conn.cursor(dictionary=True)
+        try:
+            if self.last_updated is None:
+                cursor.execute("SELECT * FROM scraping_targets")
+                rows = cursor.fetchall()
+                self.targets = {row['id']: row for row in rows}
+                logger.info(f"ターゲットを読み込みました: {len(rows)}件")
+            else:
+                cursor.execute("SELECT * FROM scraping_targets WHERE updated_at >= %s", (self.last_updated,))
+                rows = cursor.fetchall()
+                cursor.execute("SELECT id FROM scraping_targets")
+                ids = {row['id'] for row in cursor.fetchall()}
+                removed = self.targets.keys() - ids
+                for target_id in removed:
+                    del self.targets[target_id]
+                changed = [row for row in rows if self.targets.get(row['id']) != row]
+                for row in changed:
+                    self.targets[row['id']] = row
+                if changed or removed:
+                    logger.info(f"ターゲットの変更を反映しました: 追加・更新{len(changed)}件, 削除{len(removed)}件")
+            for row in rows:
+                updated_at = row.get('updated_at')
+                if updated_at is not None and (self.last_updated is None or updated_at > self.last_updated):
+                    self.last_updated = updated_at
+            return [self.targets[target_id] for target_id in sorted(self.targets)]
+        finally:
+            cursor.close()
+
+class TransferStats:
+    """1回の実行の転送量を、ターゲット毎と合計で集計します。"""
+
+    def __init__(self):
+        self.targets = {}
+
+    def add(self, target, state):
+        transfer = state.get('transfer')
+        if transfer:
+            self.targets[target['id']] = (target['url'],) + tuple(transfer)
+
+    def totals(self):
+        wire = sum(wire for _, wire, _ in self.targets.values())
+        body = sum(body for _, _, body in self.targets.values())
+        return wire, body
+
+    def save(self, conn):
+        """実行毎の合計をtransfer_runsに1行記録します。ターゲット毎の転送量はResultWriterがtransfer_statsに記録します。"""
+        if not self.targets:
+            return
+        wire, body = self.totals()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO transfer_runs (run_at, target_count, wire_bytes, body_bytes)
+                VALUES (NOW(), %s, %s, %s)
+            """, (len(self.targets), wire, body))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"転送量の記録中にエラーが発生しました: {e}")
+            conn.rollback()
+        finally:
+            cursor.close()
+
+    def report(self, top=5):
+        wire, body = self.totals()
+        ratio = f" (圧縮率 {wire / body:.0%})" if body else ""
+        logger.info(f"転送量: {len(self.targets)}件 受信 {wire} バイト / 展開後 {body} バイト{ratio}")
+        heaviest = sorted(self.targets.values(), key=lambda item: item[1], reverse=True)[:top]
+        for url, wire, body in heaviest:
+            logger.info(f"  受信 {wire} バイト / 展開後 {body} バイト: {url}")
+
+def load_latest_contents(conn):
+    """ターゲット毎の最新のscraping_results.content_digestを返します。"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT r.target_id, r.content_digest
+            FROM scraping_results r
+            JOIN (SELECT target_id, MAX(id) AS id FROM scraping_results GROUP BY target_id) latest ON r.id = latest.id
+        """)
+        return {target_id: bytes(digest) if digest is not None else None for target_id, digest in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def load_rebaseline_targets(conn):
+    """rebaseline_targetsに登録されたターゲットの、最新のscraping_results.idを返します(行がなければNone)。"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT b.target_id, MAX(r.id)
+            FROM rebaseline_targets b
+            LEFT JOIN scraping_results r ON r.target_id = b.target_id
+            GROUP BY b.target_id
+        """)
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+def load_fetch_states(conn):
+    """fetch_stateテーブルをtarget_idをキーとする辞書として読み込みます。"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT target_id, etag, last_modified, body_hash, content_hash, next_check_at, discovery_lastmod FROM fetch_state")
+        return {row['target_id']: row for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def fetch_target(user_agent, target, limiter=None, state=None):
+    """ターゲットを取得し、scraping_resultsに挿入する値を返します。DBには触れません。
+
+    前回から変更がない場合(304)は NOT_MODIFIED を返します。
+    """
     url = target['url']
     check_lastmodified = target['check_lastmodified']
     tag = target['tag']
     tag_id = target['tag_id']
     tag_class = target['tag_class']
-    target_id = target['id']
 
-    user_agent = session.headers['User-Agent']
+    if limiter is None:
+        last_content, last_update, content_hash = get_initial_content(url, check_lastmodified, tag, tag_id, tag_class, user_agent, state, target.get('extractor'), target.get('max_body_bytes'))
+    else:
+        with limiter.slot(url):
+            last_content, last_update, content_hash = get_initial_content(url, check_lastmodified, tag, tag_id, tag_class, user_agent, state, target.get('extractor'), target.get('max_body_bytes'))
+
+    return to_result(target, last_content, last_update, content_hash)
 
-    last_content, last_update, content_hash = get_initial_content(url, check_lastmodified, tag, tag_id, tag_class, user_agent)
-    
+def to_result(target, last_content, last_update, content_hash):
+    """get_initial_contentの戻り値を、scraping_resultsに挿入する値(またはNOT_MODIFIED/None)に変換します。"""
+    url = target['url']
+    if last_content is NOT_MODIFIED:
+        logger.info(f"更新はありません: {url}")
+        return NOT_MODIFIED
     if last_content is None:
         logger.error(f"コンテンツの取得に失敗しました: {url}")
-        return
+        return None
 
-    cursor = conn.cursor()
-    try:
-        if not check_lastmodified:
-            # check_lastmodified=0の場合、SHA3-512ハッシュ値を計算
-            last_content = calculate_sha3_512(last_content)
-            last_update = datetime.now(timezone.utc)
+    if not target['check_lastmodified']:
+        # check_lastmodified=0の場合、抽出したテキストのSHA3-512ダイジェストを格納
+        digest = bytes.fromhex(content_hash) if content_hash else calculate_digest(last_content)
+        last_update = datetime.now(timezone.utc)
+    else:
+        # check_lastmodified=1の場合、last_updateにLast-Modifiedの日時、ダイジェストはヘッダーの文字列から計算
+        digest = calculate_digest(last_content)
 
-        cursor.execute("""
-            INSERT INTO scraping_results (target_id, last_content, last_update, content_hash)
-            VALUES (%s, %s, %s, %s)
-        """, (target_id, last_content, last_update, content_hash))
-        conn.commit()
-        logger.info(f"URLの処理が完了しました: {url}")
-    except Exception as e:
-        logger.error(f"データベース挿入エラー: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
+    return (target['id'], digest, last_update)
+
+def build_fetch_plan(targets):
+    """ターゲットを取得単位にまとめます。
+
+    check_lastmodified=FALSEのターゲットは正規化したURL毎にまとめ、1回の取得で処理します。
+    HEADで済むcheck_lastmodified=TRUEのターゲットは個別に取得します。
+    """
+    plan = []
+    groups = {}
+    for target in targets:
+        if target['check_lastmodified']:
+            plan.append([target])
+            continue
+        key = normalize_url(target['url'])
+        if key not in groups:
+            groups[key] = []
+            plan.append(groups[key])
+        groups[key].append(target)
+    return plan
+
+def fetch_group(user_agent, group, limiter, states, breaker, budget=None):
+    """取得計画の1単位を取得し、(target, result) のリストを返します。
+
+    サーキットブレーカーが開いているホストと、時間予算を使い切った後の取得は行わず、空のリストを返します。
+    ホスト毎のスロットを得た後にもサーキットブレーカーを確認し、待機中に障害と判定されたホストは取得しません。
+    延期したターゲットはnext_check_atを更新しないので、次回の実行で取得されます。
+    """
+    url = group[0]['url']
+    host = host_of(url)
+    if budget is not None and not budget.can_start('fetch'):
+        budget.defer('fetch', url)
+        return []
+    if not breaker.allow(host):
+        logger.warning(f"障害中のホストのためスキップします: {url} ({len(group)}件)")
+        return []
+
+    with limiter.slot(url):
+        # 同じホストの取得を待っている間にサーキットブレーカーが開いた場合は、タイムアウトを待たずにスキップする
+        if not breaker.allow(host):
+            logger.warning(f"待機中にホストが障害中となったためスキップします: {url} ({len(group)}件)")
+            return []
+        if len(group) == 1:
+            target = group[0]
+            results = [(target, fetch_target(user_agent, target, state=states[target['id']]))]
+        else:
+            logger.debug(f"{len(group)}件のターゲットを1回の取得で処理します: {url}")
+            contents = get_group_content(url, group, user_agent, states)
+            results = [(target, to_result(target, *contents[target['id']])) for target in group]
 
-def process_urls(conn):
+        # 待機中のワーカーがスロットを得る前に結果を反映する
+        errors = [states[target['id']]['fetch_error'] for target in group if states[target['id']].get('fetch_error')]
+        if errors:
+            breaker.record_failure(host, errors[0])
+        else:
+            breaker.record_success(host)
+    return results
+
+INSERT_RESULT = """
+    INSERT INTO scraping_results (target_id, content_digest, last_update)
+    VALUES (%s, %s, %s)
+"""
+UPSERT_FETCH_STATE = """
+    INSERT INTO fetch_state (target_id, etag, last_modified, body_hash, content_hash, discovery_lastmod, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE etag = VALUES(etag), last_modified = VALUES(last_modified),
+        body_hash = VALUES(body_hash), content_hash = VALUES(content_hash),
+        discovery_lastmod = VALUES(discovery_lastmod), updated_at = NOW()
+"""
+REBASELINE_RESULT = """
+    UPDATE scraping_results SET content_digest = %s WHERE id = %s
+"""
+DELETE_REBASELINE = """
+    DELETE FROM rebaseline_targets WHERE target_id = %s
+"""
+UPSERT_TRANSFER_STATS = """
+    INSERT INTO transfer_stats (target_id, fetch_count, wire_bytes, body_bytes, last_wire_bytes, last_body_bytes, updated_at)
+    VALUES (%s, 1, %s, %s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE fetch_count = fetch_count + 1,
+        wire_bytes = wire_bytes + VALUES(wire_bytes), body_bytes = body_bytes + VALUES(body_bytes),
+        last_wire_bytes = VALUES(last_wire_bytes), last_body_bytes = VALUES(last_body_bytes), updated_at = NOW()
+"""
+INSERT_ACTION_LOG = """
+    INSERT INTO action_logs (target_id, action_type, status, action_time, message)
+    VALUES (%s, %s, %s, NOW(), %s)
+"""
+
+def fetch_state_row(target_id, state):
+    return (target_id, state.get('etag'), state.get('last_modified'), state.get('body_hash'), state.get('content_hash'),
+            state.get('discovery_lastmod'))
+
+def validators_changed(state, previous):
+    """未変更のターゲットでも、ETag/Last-Modifiedやフィードの更新日時が変わった場合はfetch_stateを更新します。"""
+    if previous is None:
+        return False
+    keys = ('etag', 'last_modified', 'discovery_lastmod')
+    return any(state.get(key) != previous.get(key) for key in keys)
+
+class ResultWriter:
+    """取得結果をまとめてDBに書き込みます。
+
+    ターゲット毎の書き込み(scraping_results, fetch_state, transfer_stats, action_logs)をためておき、
+    batch_size件毎にexecutemanyで1トランザクションとして書き込みます。まとめた書き込みが
+    失敗した場合はロールバックし、1件ずつ書き込み直して失敗した行だけを除きます。
+    latest_contentsを渡した場合は、最新の行と内容が同じ結果を挿入しません(write-on-change)。
+    rebaselineに登録されたターゲットは、結果を挿入せずに最新の行のダイジェストを置き換えます。
+    デコード方法の変更などでダイジェストだけが変わった場合に、更新として扱わないためです。
+    """
+
+    def __init__(self, conn, batch_size=None, latest_contents=None, rebaseline=None):
+        self.conn = conn
+        self.latest_contents = latest_contents
+        self.rebaseline = rebaseline or {}
+        self.batch_size = max(1, batch_size or WRITE_BATCH_SIZE)
+        self.pending = []
+        self.stored_ids = []
+        self.checked_ids = []
+
+    def add(self, target, result, state, previous=None):
+        """fetch_targetの結果をためます。batch_size件たまったら書き込みます。"""
+        unit = {'target': target, 'row': None, 'rebaseline': None, 'state': None, 'transfer': None, 'logs': [], 'checked': False}
+        if result is None and state.get('fetch_error'):
+            # ホスト側の障害による取得失敗
+            unit['logs'].append((target['id'], 'check', False, f"取得失敗: {state['fetch_error']}"[:1000]))
+        elif result is NOT_MODIFIED:
+            if validators_changed(state, previous):
+                unit['state'] = fetch_state_row(target['id'], state)
+            unit['checked'] = True
+        elif result is not None:
+            if target['id'] in self.rebaseline:
+                unit['rebaseline'] = (result[1], self.rebaseline[target['id']])
+                if unit['rebaseline'][1] is None:
+                    unit['row'] = result
+            elif self.latest_contents is None or self.latest_contents.get(target['id']) != result[1]:
+                unit['row'] = result
+            unit['state'] = fetch_state_row(target['id'], state)
+            unit['checked'] = True
+        transfer = state.get('transfer')
+        if transfer:
+            # 304でも受信量は計上する。action_logsには書かず、ターゲット毎の累計だけを更新する
+            unit['transfer'] = (target['id'], transfer[0], transfer[1], transfer[0], transfer[1])
+
+        if (unit['row'] is None and unit['rebaseline'] is None and unit['state'] is None
+                and unit['transfer'] is None and not unit['logs']):
+            if unit['checked']:
+                self.checked_ids.append(target['id'])
+            return
+        self.pending.append(unit)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        units, self.pending = self.pending, []
+        cursor = self.conn.cursor()
+        try:
+            rows = [unit['row'] for unit in units if unit['row'] is not None]
+            rebaselines = [unit for unit in units if unit['rebaseline'] is not None]
+            states = [unit['state'] for unit in units if unit['state'] is not None]
+            transfers = [unit['transfer'] for unit in units if unit['transfer'] is not None]
+            logs = [log for unit in units for log in unit['logs']]
+            if rows:
+                cursor.executemany(INSERT_RESULT, rows)
+            if rebaselines:
+                digests = [unit['rebaseline'] for unit in rebaselines if unit['rebaseline'][1] is not None]
+                if digests:
+                    cursor.executemany(REBASELINE_RESULT, digests)
+                cursor.executemany(DELETE_REBASELINE, [(unit['target']['id'],) for unit in rebaselines])
+            if states:
+                cursor.executemany(UPSERT_FETCH_STATE, states)
+            if transfers:
+                cursor.executemany(UPSERT_TRANSFER_STATS, transfers)
+            if logs:
+                cursor.executemany(INSERT_ACTION_LOG, logs)
+            self.conn.commit()
+        except Exception as e:
+            logger.warning(f"まとめた書き込みに失敗したため、1件ずつ書き込みます ({len(units)}件): {e}")
+            self.conn.rollback()
+            units = [unit for unit in units if self.write_one(cursor, unit)]
+        finally:
+            cursor.close()
+        for unit in units:
+            self.written(unit)
+        logger.debug(f"{len(units)}件の取得結果を書き込みました。")
+
+    def write_one(self, cursor, unit):
+        """1ターゲット分の書き込みを1トランザクションで行います。成功時にTrueを返します。"""
+        try:
+            if unit['row'] is not None:
+                cursor.execute(INSERT_RESULT, unit['row'])
+            if unit['rebaseline'] is not None:
+                if unit['rebaseline'][1] is not None:
+                    cursor.execute(REBASELINE_RESULT, unit['rebaseline'])
+                cursor.execute(DELETE_REBASELINE, (unit['target']['id'],))
+            if unit['state'] is not None:
+                cursor.execute(UPSERT_FETCH_STATE, unit['state'])
+            if unit['transfer'] is not None:
+                cursor.execute(UPSERT_TRANSFER_STATS, unit['transfer'])
+            for log in unit['logs']:
+                cursor.execute(INSERT_ACTION_LOG, log)
+            self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"データベース書き込みエラー ({unit['target']['url']}): {e}")
+            self.conn.rollback()
+            return False
+
+    def written(self, unit):
+        target = unit['target']
+        if unit['rebaseline'] is not None:
+            del self.rebaseline[target['id']]
+            if unit['rebaseline'][1] is not None:
+                logger.info(f"ダイジェストを新しい値で置き換えました(更新として扱いません): {target['url']}")
+        if unit['row'] is not None:
+            self.stored_ids.append(target['id'])
+            logger.info(f"URLの処理が完了しました: {target['url']}")
+        if unit['checked']:
+            self.checked_ids.append(target['id'])
+
+def process_urls(conn, max_workers=None, max_per_host=None, full_sweep=False, budget=None, target_cache=None):
+    """取得時刻に達したターゲットを取得し、scraping_resultsに新しい行を挿入したtarget_idのリストを返します。
+
+    full_sweepがTrueの場合は、next_check_atに関係なく全ターゲットを取得します。
+    host_failuresで障害中とされたホストのターゲットは、full_sweepでもスキップします。
+    target_cacheを渡した場合は、scraping_targetsの全行ではなく変更された行だけを読み直します。
+    discovery_urlが設定されたターゲットは、フィード・サイトマップで更新が確認できたものだけを取得します。
+    """
+    max_workers = DEFAULT_MAX_WORKERS if max_workers is None else max_workers
+    max_per_host = DEFAULT_MAX_PER_HOST if max_per_host is None else max_per_host
+
+    writer = ResultWriter(conn)
+    transfer = TransferStats()
+    now = utcnow()
     cursor = conn.cursor(dictionary=True)
     try:
-        cursor.execute("SELECT * FROM scraping_targets")
-        targets = cursor.fetchall()
+        states = load_fetch_states(conn)
+        if WRITE_ON_CHANGE:
+            writer.latest_contents = load_latest_contents(conn)
+        writer.rebaseline = load_rebaseline_targets(conn)
+        breaker = HostCircuitBreaker.load(conn, now)
+        if target_cache is not None:
+            targets = target_cache.refresh(conn)
+        else:
+            cursor.execute("SELECT * FROM scraping_targets")
+            targets = cursor.fetchall()
         cursor.execute("SELECT agent FROM user_agents ORDER BY RAND() LIMIT 1")
         user_agent = cursor.fetchone()['agent']
 
         logger.debug(f"Found {len(targets)} targets")
+        if not full_sweep:
+            total = len(targets)
+            targets = due_targets(targets, states, now)
+            logger.info(f"取得時刻に達したターゲット: {len(targets)}/{total}件")
         logger.debug(f"Selected user agent: {user_agent}")
 
-        import requests
-        session = requests.Session()
-        session.headers.update({'User-Agent': user_agent})
-
-        for target in targets:
-            try:
-                process_target(conn, session, target)
-            except Exception as e:
-                logger.error(f"ターゲット処理中にエラーが発生しました ({target['url']}): {e}")
+        # 取得はワーカースレッドで並行に行い、DBへの書き込みはこのスレッドでまとめて行う
+        limiter = HostLimiter(max_per_host)
+        logger.debug(f"並行取得: workers={max_workers}, per_host={max_per_host}")
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            if not full_sweep:
+                targets, skipped, lastmods = filter_by_discovery(targets, states, user_agent, executor, limiter, breaker)
+                # フィードで更新がないと確認できたターゲットは、取得したものとして次回取得時刻を更新する
+                writer.checked_ids.extend(target['id'] for target in skipped)
+            else:
+                lastmods = {}
+            plan = build_fetch_plan(targets)
+            logger.debug(f"取得計画: {len(targets)}件のターゲットを{len(plan)}回の取得で処理します")
+            futures = {}
+            for group in plan:
+                group_states = {target['id']: dict(states.get(target['id'], {})) for target in group}
+                for target in group:
+                    if target['id'] in lastmods:
+                        group_states[target['id']]['discovery_lastmod'] = lastmods[target['id']]
+                future = executor.submit(fetch_group, user_agent, group, limiter, group_states, breaker, budget)
+                futures[future] = (group, group_states)
+            for future in as_completed(futures):
+                group, group_states = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.error(f"ターゲット処理中にエラーが発生しました ({group[0]['url']}): {e}")
+                    continue
+                for target, result in results:
+                    writer.add(target, result, group_states[target['id']], states.get(target['id']))
+                    transfer.add(target, group_states[target['id']])
+        writer.flush()
+        breaker.save(conn)
+        transfer.report()
+        transfer.save(conn)
+        schedule_targets(conn, writer.checked_ids, now)
     except Exception as e:
         logger.error(f"URL処理中にエラーが発生しました: {e}")
     finally:
         cursor.close()
+    return writer.stored_ids
 
 if __name__ == "__main__":
     # テスト用のコード
@@ -2,27 +2,90 @@
 # glc_utils.py
 
 import os
-import mysql.connector
+import re
+import codecs
+import threading
+import http.cookiejar
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util import make_headers
 import savepagenow
-import json
+from urllib.parse import urlsplit, urlunsplit
 from datetime import datetime, timezone, time
 import pytz
-from bs4 import BeautifulSoup
+from glc_extract import select_extractor, ElementCloseWatcher
+from glc_db import get_db_connection, get_pooled_connection
 
-def get_db_connection(db_name=None):
-    """データベースへの接続を取得します。"""
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST', 'goudge-tc01-sid'),
-            database=db_name,
-            user=os.getenv('DB_USER', 'mguuji'),
-            password=os.getenv('DB_PASSWORD')
-        )
-        return connection
-    except mysql.connector.Error as e:
-        print(f"データベース接続エラー: {e}")
-        return None
+# get_db_connectionとget_pooled_connectionは、各スクリプトがglc_utilsから読み込めるよう再エクスポートしています
+__all__ = [
+    'get_db_connection', 'get_pooled_connection',
+    'get_http_session', 'is_within_time_range', 'calculate_sha3_512', 'calculate_digest', 'calculate_body_hash',
+    'normalize_url', 'check_url_status', 'archive_with_custom_user_agent',
+    'NOT_MODIFIED', 'fetch_response', 'read_body', 'decode_body', 'fetch_url_content', 'FetchedPage',
+    'scrape_content', 'get_initial_content', 'scrape_page', 'get_group_content',
+    'log_action', 'sort_key', 'get_random_user_agent',
+]
+
+# 本文の最大サイズ(バイト)。scraping_targets.max_body_bytes が設定されたターゲットはそちらを優先します。
+MAX_BODY_BYTES = int(os.getenv('GLC_MAX_BODY_BYTES', str(10 * 1024 * 1024)))
+# 1の場合、tag_idを指定したターゲットは要素が閉じた時点で受信を打ち切ります
+STREAM_EXTRACT = os.getenv('GLC_STREAM_EXTRACT', '0') == '1'
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# 文字コードの判定: <meta charset>を探す範囲と、統計的判定に使う範囲(バイト)
+CHARSET_META_BYTES = 4 * 1024
+CHARSET_DETECT_BYTES = int(os.getenv('GLC_CHARSET_DETECT_BYTES', str(64 * 1024)))
+HEADER_CHARSET = re.compile(r'charset\s*=\s*([^\s;]+)', re.IGNORECASE)
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)|<\?xml[^>]+encoding\s*=\s*["']([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+ENCODING_ALIASES = {'shift_jis': 'cp932'}
+
+# URL毎に統計的判定で決めたエンコーディング
+_detected_encodings = {}
+_detected_encodings_lock = threading.Lock()
+
+# 共有HTTPクライアントの設定
+HTTP_POOL_HOSTS = int(os.getenv('GLC_HTTP_POOL_HOSTS', '100'))
+HTTP_POOL_SIZE = int(os.getenv('GLC_HTTP_POOL_SIZE', '4'))
+HTTP_RETRIES = int(os.getenv('GLC_HTTP_RETRIES', '1'))
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """全ステージで共有するHTTPセッションを返します。
+
+    ホスト毎にkeep-alive接続をプールし、接続エラーと502/503/504を再試行します。
+    読み込みタイムアウトは再試行しません(応答しないホストで待ち時間が倍増するため)。
+    Accept-Encodingにはurllib3が展開できる方式(gzip, deflate と、brotli・zstandard
+    パッケージがインストールされていれば br, zstd)を指定します。
+    Cookieはセッションに保存しません。ターゲット間・スレッド間・デーモンの反復間で
+    Cookieが送り返されないようにするためです(リダイレクト中のCookieはリクエスト毎に扱われます)。
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                read=0,
+                backoff_factor=0.5,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD']),
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            session.headers['Accept-Encoding'] = make_headers(accept_encoding=True)['accept-encoding']
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+        return _http_session
 
 def is_within_time_range():
     """現在の時刻が指定された時間範囲内にあるかどうかをチェックします。"""
@@ -35,10 +98,35 @@ def calculate_sha3_512(content):
     import hashlib
     return hashlib.sha3_512(content.encode('utf-8')).hexdigest()
 
+def calculate_digest(content):
+    """scraping_results.content_digestに格納するSHA3-512のダイジェスト(64バイト)を計算します。
+
+    check_lastmodified=FALSEのターゲットは抽出したテキスト、TRUEのターゲットはLast-Modifiedヘッダーの文字列から計算します。
+    """
+    import hashlib
+    return hashlib.sha3_512(content.encode('utf-8')).digest()
+
+def calculate_body_hash(body, tag, tag_id, tag_class):
+    """受信した本文と抽出条件から、変更検出用の軽量なハッシュ値を計算します。"""
+    import hashlib
+    h = hashlib.blake2b(digest_size=32)
+    h.update(f"{tag}\0{tag_id}\0{tag_class}\0".encode('utf-8'))
+    h.update(body)
+    return h.hexdigest()
+
+def normalize_url(url):
+    """フラグメントを除き、スキームとホスト名を小文字にしたURLを返します。"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
 def check_url_status(url, timeout=10):
     """URLのステータスコードをチェックします。"""
     try:
-        response = requests.head(url, allow_redirects=True, timeout=timeout)
+        response = get_http_session().head(url, allow_redirects=True, timeout=timeout)
         return response.status_code
     except requests.RequestException:
         return None
@@ -75,62 +163,306 @@ def archive_with_custom_user_agent(url, user_agent):
 
     return result
 
-def fetch_url_content(url, user_agent=None):
+# 条件付きGETで304が返された(前回から変更がない)ことを表します
+NOT_MODIFIED = object()
+
+def conditional_headers(state):
+    """前回保存したETag/Last-Modifiedから条件付きリクエストのヘッダーを作成します。"""
+    headers = {}
+    if state:
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+    return headers
+
+def update_validators(state, response):
+    """レスポンスのETag/Last-Modifiedをstateに保存します。"""
+    if state is not None:
+        state['etag'] = response.headers.get('ETag')
+        state['last_modified'] = response.headers.get('Last-Modified')
+
+def is_host_failure(error):
+    """ホスト側の障害(接続できない、タイムアウト、5xx)によるエラーかどうかを判定します。"""
+    if isinstance(error, requests.HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+def fetch_response(url, user_agent=None, state=None, method='GET', timeout=30):
+    """URLを取得してレスポンスを返します。stateがあれば条件付きリクエストを送信します。
+
+    GETの本文は読み込まずに返すので、read_bodyで読み込んでください。
+    ホスト側の障害で失敗した場合は state['fetch_error'] にエラー内容を記録します。
+    """
     headers = {'User-Agent': user_agent} if user_agent else {}
+    headers.update(conditional_headers(state))
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = get_http_session().request(method, url, headers=headers, timeout=timeout, stream=(method != 'HEAD'))
         response.raise_for_status()
-        return response.text
+        return response
     except requests.RequestException as e:
         print(f"URL取得エラー ({url}): {e}")
+        if state is not None and is_host_failure(e):
+            state['fetch_error'] = str(e)
+        return None
+
+def read_body(response, max_bytes=None, watcher=None, state=None):
+    """レスポンス本文をチャンク単位で読み込みます。
+
+    max_bytesを超えた場合はNoneを返します。watcherが要素の終了を検出した時点で
+    受信を打ち切り、それまでに受信した本文を返します。上限は展開後のサイズに対して適用します。
+    stateを渡した場合は、state['transfer'] に (受信したバイト数, 展開後のバイト数) を記録します。
+    """
+    max_bytes = max_bytes or MAX_BODY_BYTES
+    chunks = []
+    size = 0
+    try:
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                print(f"本文が上限({max_bytes}バイト)を超えました: {response.url}")
+                response.close()
+                return None
+            chunks.append(chunk)
+            if watcher is not None and watcher.feed_bytes(chunk):
+                response.close()
+                break
+    except requests.RequestException as e:
+        print(f"URL取得エラー ({response.url}): {e}")
+        response.close()
+        return None
+    finally:
+        if state is not None:
+            state['transfer'] = transfer_size(response, size)
+    return b''.join(chunks)
+
+def transfer_size(response, decoded_size):
+    """(受信したバイト数, 展開後のバイト数) を返します。受信量は圧縮されたままのサイズです。"""
+    try:
+        wire_size = response.raw.tell()
+    except Exception:
+        wire_size = None
+    return (wire_size if wire_size is not None else decoded_size, decoded_size)
+
+def canonical_encoding(name):
+    """エンコーディング名を正規化します。Pythonで扱えない名前の場合はNoneを返します。"""
+    if not name:
+        return None
+    try:
+        encoding = codecs.lookup(name.strip().strip('"\'')).name
+    except LookupError:
+        return None
+    # ブラウザと同じく、Shift_JISはWindowsの拡張文字を含むcp932として扱う
+    return ENCODING_ALIASES.get(encoding, encoding)
+
+def header_charset(response):
+    """Content-Typeヘッダーで明示されたcharsetを返します。"""
+    content_type = response.headers.get('Content-Type', '')
+    match = HEADER_CHARSET.search(content_type)
+    return canonical_encoding(match.group(1)) if match else None
+
+def bom_charset(body):
+    for bom, encoding in BOMS:
+        if body.startswith(bom):
+            return encoding
+    return None
+
+def meta_charset(body):
+    """本文の先頭 CHARSET_META_BYTES バイトから<meta charset>またはXML宣言のencodingを探します。"""
+    match = META_CHARSET.search(body[:CHARSET_META_BYTES])
+    return canonical_encoding((match.group(1) or match.group(2)).decode('ascii')) if match else None
+
+def detect_charset(body):
+    """本文の先頭 CHARSET_DETECT_BYTES バイトだけを統計的に判定します。"""
+    if not body or requests.compat.chardet is None:
+        return None
+    return canonical_encoding(requests.compat.chardet.detect(body[:CHARSET_DETECT_BYTES])['encoding'])
+
+def resolve_encoding(response, body):
+    """本文のエンコーディングを決めます。
+
+    WHATWGのエンコーディング判定と同じくBOMを最優先し、次にHTTPヘッダー、<meta charset>の順に調べます。
+    いずれもなければ同じURLで前回判定したエンコーディングを使い、それもなければ先頭部分の統計的判定を行います。
+    記憶するのは統計的判定の結果だけで、ページ毎に異なりうるため、ホストではなくURL毎に記憶します。
+    """
+    encoding = bom_charset(body) or header_charset(response) or meta_charset(body)
+    if encoding:
+        return encoding
+    url = response.url or ''
+    with _detected_encodings_lock:
+        encoding = _detected_encodings.get(url)
+    if encoding is None:
+        encoding = detect_charset(body)
+        if encoding:
+            with _detected_encodings_lock:
+                _detected_encodings[url] = encoding
+    return encoding or 'utf-8'
+
+def decode_body(response, body):
+    """本文をresolve_encodingで決めたエンコーディングで文字列に変換します。"""
+    encoding = resolve_encoding(response, body)
+    if body.startswith(codecs.BOM_UTF8) and encoding == 'utf-8':
+        encoding = 'utf-8-sig'
+    try:
+        return str(body, encoding, errors='replace')
+    except (LookupError, TypeError):
+        return str(body, errors='replace')
+
+def fetch_url_content(url, user_agent=None, max_bytes=None):
+    response = fetch_response(url, user_agent)
+    if response is None:
         return None
+    body = read_body(response, max_bytes)
+    return decode_body(response, body) if body is not None else None
 
-def scrape_content(content, tag, tag_id, tag_class):
-    soup = BeautifulSoup(content, 'html.parser')
-    if tag_id:
-        elements = soup.find_all(tag, id=tag_id)
-    elif tag_class:
-        classes = tag_class.split()
-        elements = soup.find_all(tag, class_=lambda x: x and all(c in x.split() for c in classes))
+class FetchedPage:
+    """取得したページの本文と、デコード結果・解析結果のキャッシュです。
+
+    同じページを監視する複数のターゲットで、デコードと解析を1回で済ませるために使います。
+    """
+
+    def __init__(self, response, body):
+        self.response = response
+        self.body = body
+        self.documents = {}
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = decode_body(self.response, self.body)
+        return self._text
+
+def scrape_content(content, tag, tag_id, tag_class, extractor=None, documents=None):
+    """指定された要素のテキストを抽出します。extractorで抽出バックエンド(bs4, lxml)を指定できます。
+
+    documentsに辞書を渡すと、解析結果をバックエンド名をキーとしてキャッシュします。
+    """
+    backend = select_extractor(extractor, content)
+    if documents is None:
+        doc = backend.parse(content)
     else:
-        elements = soup.find_all(tag)
+        if backend.name not in documents:
+            documents[backend.name] = backend.parse(content)
+        doc = documents[backend.name]
+    texts = backend.extract(doc, tag, tag_id, tag_class)
 
-    if elements:
-        return '\n'.join([element.text.strip() for element in elements])
+    if texts:
+        return '\n'.join(texts)
     else:
         print(f"要素が見つかりません: tag={tag}, tag_id={tag_id}, tag_class={tag_class}")
-        print(f"ページの内容（最初の500文字）: {soup.prettify()[:500]}...")
+        print(f"ページの内容（最初の500文字）: {backend.preview(doc)}...")
         return None
 
-def get_initial_content(url, check_lastmodified, tag, tag_id, tag_class, user_agent):
-    headers = {'User-Agent': user_agent}
+def get_initial_content(url, check_lastmodified, tag, tag_id, tag_class, user_agent, state=None, extractor=None, max_body_bytes=None):
+    """ターゲットを取得します。
+
+    stateにはfetch_stateテーブルの行(etag, last_modified, body_hash, content_hash)を渡します。
+    渡された場合は条件付きリクエストを送信し、304が返されたときは (NOT_MODIFIED, None, None) を
+    返します。本文のハッシュ値が前回と同じときは解析を省略し、(NOT_MODIFIED, None, 前回のcontent_hash)
+    を返します。取得とスクレイピングに成功したときだけstateを更新します。
+    extractorはscrape_contentに渡す抽出バックエンド名、max_body_bytesは本文の最大サイズです。
+    GLC_STREAM_EXTRACT=1 の場合、tag_idのターゲットは要素が閉じた時点で受信を打ち切ります。
+    """
     if check_lastmodified:
-        try:
-            response = requests.head(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            last_modified = response.headers.get('Last-Modified')
-            if last_modified:
-                last_update = datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z").replace(tzinfo=timezone.utc)
-                return last_modified, last_update, None
-            else:
-                print(f"Last-Modifiedヘッダーがありません: {url}")
-                return None, None, None
-        except requests.RequestException as e:
-            print(f"URL取得エラー ({url}): {e}")
+        response = fetch_response(url, user_agent, state, method='HEAD')
+        if response is None:
+            return None, None, None
+        if response.status_code == 304:
+            return NOT_MODIFIED, None, None
+        last_modified = response.headers.get('Last-Modified')
+        if last_modified:
+            last_update = datetime.strptime(last_modified, "%a, %d %b %Y %H:%M:%S %Z").replace(tzinfo=timezone.utc)
+            update_validators(state, response)
+            return last_modified, last_update, None
+        else:
+            print(f"Last-Modifiedヘッダーがありません: {url}")
             return None, None, None
     else:
-        content = fetch_url_content(url, user_agent)
-        if content is None:
+        response = fetch_response(url, user_agent, state)
+        if response is None:
             return None, None, None
+        if response.status_code == 304:
+            # 空の本文を読み切って接続をプールに戻す
+            read_body(response)
+            return NOT_MODIFIED, None, None
 
-        scraped_content = scrape_content(content, tag, tag_id, tag_class)
-        if scraped_content is None:
-            print(f"コンテンツのスクレイピングに失敗しました: {url}")
+        watcher = ElementCloseWatcher(tag, tag_id, header_charset(response)) if STREAM_EXTRACT and tag_id else None
+        body = read_body(response, max_body_bytes, watcher, state)
+        if body is None:
             return None, None, None
 
-        last_update = datetime.now(timezone.utc)
-        content_hash = calculate_sha3_512(scraped_content)
-        return scraped_content, last_update, content_hash
+        return scrape_page(url, FetchedPage(response, body), tag, tag_id, tag_class, state, extractor)
+
+def scrape_page(url, page, tag, tag_id, tag_class, state=None, extractor=None):
+    """取得済みのページからターゲットの内容を抽出します。戻り値はget_initial_contentと同じです。"""
+    # 本文が前回と同じなら、解析せずに前回の抽出結果のハッシュ値を使う
+    body_hash = calculate_body_hash(page.body, tag, tag_id, tag_class)
+    if state is not None and state.get('content_hash') and state.get('body_hash') == body_hash:
+        update_validators(state, page.response)
+        return NOT_MODIFIED, None, state['content_hash']
+
+    scraped_content = scrape_content(page.text, tag, tag_id, tag_class, extractor, page.documents)
+    if scraped_content is None:
+        print(f"コンテンツのスクレイピングに失敗しました: {url}")
+        return None, None, None
+
+    last_update = datetime.now(timezone.utc)
+    content_hash = calculate_sha3_512(scraped_content)
+    update_validators(state, page.response)
+    if state is not None:
+        state['body_hash'] = body_hash
+        state['content_hash'] = content_hash
+    return scraped_content, last_update, content_hash
+
+def shared_validators(states):
+    """全ターゲットのETag/Last-Modifiedと抽出結果が揃っている場合だけ、共通のバリデータを返します。"""
+    validators = {(state.get('etag'), state.get('last_modified')) for state in states}
+    if len(validators) != 1 or not all(state.get('content_hash') for state in states):
+        return None
+    etag, last_modified = validators.pop()
+    return {'etag': etag, 'last_modified': last_modified}
+
+def get_group_content(url, targets, user_agent, states):
+    """同じページを監視する複数のターゲットを、1回の取得と1回の解析で処理します。
+
+    targetsはcheck_lastmodified=FALSEのscraping_targetsの行、statesはtarget_idをキーとする
+    fetch_stateの辞書です。target_idをキーとして、get_initial_contentと同じ形式のタプルを返します。
+    """
+    failed = {target['id']: (None, None, None) for target in targets}
+    member_states = [states[target['id']] for target in targets]
+
+    # 304は全ターゲットのバリデータが同じ場合にだけ「全て未変更」と判断できる
+    request_state = shared_validators(member_states) or {}
+    response = fetch_response(url, user_agent, request_state)
+    if response is None:
+        if 'fetch_error' in request_state:
+            for state in member_states:
+                state['fetch_error'] = request_state['fetch_error']
+        return failed
+    if response.status_code == 304:
+        read_body(response)
+        return {target['id']: (NOT_MODIFIED, None, None) for target in targets}
+
+    max_body_bytes = max(target.get('max_body_bytes') or MAX_BODY_BYTES for target in targets)
+    # 共有したページの転送量は先頭のターゲットにだけ計上する
+    body = read_body(response, max_body_bytes, state=member_states[0])
+    if body is None:
+        return failed
+
+    page = FetchedPage(response, body)
+    return {
+        target['id']: scrape_page(target['url'], page, target['tag'], target['tag_id'], target['tag_class'],
+                                  states[target['id']], target.get('extractor'))
+        for target in targets
+    }
+
+def log_action(cursor, target_id, action_type, status, message):
+    """action_logsテーブルに処理結果を記録します。コミットは呼び出し側で行います。"""
+    cursor.execute("""
+        INSERT INTO action_logs (target_id, action_type, status, action_time, message)
+        VALUES (%s, %s, %s, NOW(), %s)
+    """, (target_id, action_type, status, message))
 
 def sort_key(target):
     jst = pytz.timezone('Asia/Tokyo')
@@ -142,30 +474,6 @@ def sort_key(target):
             last_update = last_update.replace(tzinfo=timezone.utc)
     return last_update.astimezone(jst)
 
-# glc_utils.py に追加
-
-def compress_scraping_results(db_name):
-    """スクレイピング結果テーブルから重複したレコードを削除します。"""
-    conn = get_db_connection(db_name)
-    if conn is None:
-        return
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            DELETE t1 FROM scraping_results t1
-            INNER JOIN scraping_results t2
-            WHERE t1.id < t2.id AND t1.target_id = t2.target_id AND t1.last_content = t2.last_content
-        """)
-        deleted_count = cursor.rowcount
-        conn.commit()
-        print(f"圧縮完了: {deleted_count}件の重複レコードを削除しました。")
-    except Exception as e:
-        print(f"圧縮中にエラーが発生しました: {str(e)}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
-
 def get_random_user_agent(conn):
     """ランダムなユーザーエージェントを取得します。"""
     cursor = conn.cursor(dictionary=True)
@@ -16,7 +16,7 @@ def get_all_updates(db_name):
     cursor = conn.cursor(dictionary=True)
     try:
         query = """
-        SELECT t.url, r.last_update, r.last_content
+        SELECT t.url, r.last_update, HEX(r.content_digest) AS content_digest
         FROM scraping_targets t
         JOIN scraping_results r ON t.id = r.target_id
         ORDER BY t.url, r.last_update
@@ -31,7 +31,7 @@ def get_all_updates(db_name):
                 updates[url] = []
             updates[url].append({
                 'last_update': row['last_update'].isoformat() if row['last_update'] else None,
-                'last_content': row['last_content']
+                'content_digest': row['content_digest']
             })
 
         return updates
@@ -43,7 +43,7 @@ def get_all_updates(db_name):
         conn.close()
 
 def main():
-    parser = argparse.ArgumentParser(description="Retrieve all last_update and last_content for each URL")
+    parser = argparse.ArgumentParser(description="Retrieve all last_update and content_digest for each URL")
     parser.add_argument("--db", required=True, help="Database name")
     args = parser.parse_args()
 
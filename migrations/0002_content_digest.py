@@ -0,0 +1,56 @@
+# 0002_content_digest.py
+# scraping_resultsのlast_content(TEXT)から、BINARY(64)のcontent_digestを埋めます
+#
+# - 128文字の16進数(SHA3-512)はそのままバイト列に変換
+# - それ以外(Last-Modifiedの文字列)はglc_utils.calculate_digestで計算
+# 行数が多くてもロックが長くならないよう、1000件ずつコミットします。
+
+import re
+import logging
+from glc_utils import calculate_digest
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+HEX_DIGEST = re.compile(r'^[0-9a-fA-F]{128}$')
+
+def to_digest(last_content):
+    if last_content is None:
+        return None
+    if HEX_DIGEST.match(last_content):
+        return bytes.fromhex(last_content)
+    return calculate_digest(last_content)
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+def upgrade(conn):
+    cursor = conn.cursor()
+    updated = 0
+    last_id = 0
+    try:
+        if not column_exists(cursor, 'scraping_results', 'last_content'):
+            return
+        while True:
+            cursor.execute("""
+                SELECT id, last_content FROM scraping_results
+                WHERE id > %s AND content_digest IS NULL AND last_content IS NOT NULL
+                ORDER BY id LIMIT %s
+            """, (last_id, BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany(
+                "UPDATE scraping_results SET content_digest = %s WHERE id = %s",
+                [(to_digest(last_content), row_id) for row_id, last_content in rows]
+            )
+            conn.commit()
+            updated += len(rows)
+            last_id = rows[-1][0]
+            logger.info(f"{updated}件のcontent_digestを設定しました (id <= {last_id})")
+    finally:
+        cursor.close()
@@ -0,0 +1,20 @@
+# 0003_drop_last_content.py
+# content_digestへの移行が済んだscraping_resultsから、last_contentとcontent_hashを削除します
+
+def upgrade(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'scraping_results' AND COLUMN_NAME = 'last_content'
+        """)
+        if cursor.fetchone()[0] == 0:
+            return
+        cursor.execute("SELECT COUNT(*) FROM scraping_results WHERE content_digest IS NULL AND last_content IS NOT NULL")
+        remaining = cursor.fetchone()[0]
+        if remaining:
+            raise RuntimeError(f"content_digestが未設定の行が{remaining}件あります。0002を再実行してください。")
+        cursor.execute("ALTER TABLE scraping_results DROP COLUMN IF EXISTS last_content, DROP COLUMN IF EXISTS content_hash")
+        conn.commit()
+    finally:
+        cursor.close()
@@ -0,0 +1,59 @@
+-- 0004_change_events.sql
+-- 更新の検出時にglc_diffが1行ずつ追加するchange_eventsテーブルを作成し、
+-- updated_targets_viewをscraping_results全体のウィンドウ関数からchange_eventsの読み出しに置き換えます。
+
+CREATE TABLE IF NOT EXISTS change_events (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  target_id INT NOT NULL,
+  result_id INT NOT NULL,
+  last_update DATETIME,
+  archive_url TEXT,
+  detected_at DATETIME NOT NULL,
+  UNIQUE KEY (result_id),
+  FOREIGN KEY (target_id) REFERENCES scraping_targets(id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
+
+CREATE INDEX IF NOT EXISTS idx_change_events_target_id_id ON change_events (target_id, id);
+CREATE INDEX IF NOT EXISTS idx_change_events_last_update ON change_events (last_update);
+
+-- 既存の履歴から、直前の行とダイジェストが異なる行を更新として登録します。
+-- check_lastmodified=TRUEのターゲットは最初の行(Last-Modifiedの日時)も更新として扱います。
+-- アーカイブURLは従来のビューと同じく、ターゲットの最新のものを設定します。
+INSERT IGNORE INTO change_events (target_id, result_id, last_update, archive_url, detected_at)
+SELECT r.target_id, r.id, r.last_update, a.archive_url, NOW()
+FROM (
+    SELECT id, target_id, last_update, content_digest,
+           LAG(content_digest) OVER (PARTITION BY target_id ORDER BY id) AS previous_digest,
+           ROW_NUMBER() OVER (PARTITION BY target_id ORDER BY id) AS rn
+    FROM scraping_results
+) r
+JOIN scraping_targets t ON t.id = r.target_id
+LEFT JOIN (
+    SELECT target_id, archive_url
+    FROM (
+        SELECT target_id, archive_url,
+               ROW_NUMBER() OVER (PARTITION BY target_id ORDER BY id DESC) AS row_num
+        FROM archive_urls
+    ) latest
+    WHERE row_num = 1
+) a ON a.target_id = r.target_id
+WHERE (t.check_lastmodified = TRUE AND r.rn = 1)
+   OR (r.rn > 1 AND NOT (r.content_digest <=> r.previous_digest))
+ORDER BY r.id;
+
+CREATE OR REPLACE VIEW updated_targets_view AS
+SELECT
+    t.id,
+    e.last_update,
+    t.owner,
+    t.ownerurl,
+    t.title,
+    t.url,
+    e.archive_url,
+    t.qmd_name
+FROM
+    change_events e
+JOIN
+    scraping_targets t ON t.id = e.target_id
+ORDER BY
+    e.last_update DESC;
@@ -0,0 +1,23 @@
+# 0005_drop_qmd_views.py
+# create_qmd_name_view.pyとurljson.pyが作成していた、qmd_name毎のビュー({qmd_name}_view)を削除します
+# glc_msgはchange_eventsから最新2件を1回のクエリで取得するようになったため、これらのビューは使われません。
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+def upgrade(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT v.TABLE_NAME FROM information_schema.VIEWS v
+            JOIN scraping_targets t ON v.TABLE_NAME = CONCAT(t.qmd_name, '_view')
+            WHERE v.TABLE_SCHEMA = DATABASE()
+        """)
+        views = [row[0] for row in cursor.fetchall()]
+        for view in views:
+            cursor.execute(f"DROP VIEW IF EXISTS `{view.replace('`', '``')}`")
+        conn.commit()
+        logger.info(f"{len(views)}件のqmd_name毎のビューを削除しました。")
+    finally:
+        cursor.close()
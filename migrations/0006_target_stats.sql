@@ -0,0 +1,44 @@
+-- 0006_target_stats.sql
+-- ターゲット毎の更新回数・最初と最後の更新日時・最後のアーカイブ日時を保持するtarget_statsテーブルを作成し、
+-- qmd_viewをscraping_resultsの相関サブクエリからtarget_statsの読み出しに置き換えます。
+-- 更新時はglc_diffが、アーカイブ時はglc_spnがそれぞれ更新します。
+
+CREATE TABLE IF NOT EXISTS target_stats (
+  target_id INT PRIMARY KEY,
+  update_count INT NOT NULL DEFAULT 0,
+  first_change_at DATETIME,
+  last_change_at DATETIME,
+  last_archived_at DATETIME,
+  FOREIGN KEY (target_id) REFERENCES scraping_targets(id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
+
+INSERT INTO target_stats (target_id, update_count, first_change_at, last_change_at)
+SELECT target_id, COUNT(*), MIN(last_update), MAX(last_update)
+FROM change_events
+GROUP BY target_id
+ON DUPLICATE KEY UPDATE
+  update_count = VALUES(update_count),
+  first_change_at = VALUES(first_change_at),
+  last_change_at = VALUES(last_change_at);
+
+INSERT INTO target_stats (target_id, last_archived_at)
+SELECT target_id, MAX(created_at)
+FROM archive_urls
+GROUP BY target_id
+ON DUPLICATE KEY UPDATE last_archived_at = VALUES(last_archived_at);
+
+CREATE OR REPLACE VIEW qmd_view AS
+SELECT
+    t.owner,
+    t.title,
+    t.qmd_name,
+    s.update_count,
+    s.last_change_at
+FROM
+    scraping_targets t
+LEFT JOIN
+    target_stats s ON s.target_id = t.id
+WHERE
+    t.check_lastmodified = 1 OR s.update_count > 0
+ORDER BY
+    t.owner, t.title;
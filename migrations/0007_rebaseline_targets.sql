@@ -0,0 +1,22 @@
+-- 0007_rebaseline_targets.sql
+-- 本文のデコード方法の変更(ヘッダーにcharsetがないページをISO-8859-1ではなくBOM・<meta charset>・
+-- 統計的判定で決めたエンコーディングで、Shift_JISをcp932としてデコードする)により、
+-- check_lastmodified=FALSEのターゲットは内容が変わらなくても抽出結果のダイジェストが変わります。
+-- 保存済みのダイジェストは元の内容がないため再計算できないので、これらのターゲットをrebaseline_targetsに登録し、
+-- 次回の取得時に最新のscraping_resultsのダイジェストを新しい値で置き換えます(更新として扱わず、通知もしません)。
+-- 条件付きリクエストや本文のハッシュ値で取得・解析が省略されないよう、fetch_stateも削除します。
+
+CREATE TABLE IF NOT EXISTS rebaseline_targets (
+  target_id INT PRIMARY KEY,
+  reason VARCHAR(64) NOT NULL,
+  created_at DATETIME NOT NULL,
+  FOREIGN KEY (target_id) REFERENCES scraping_targets(id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
+
+INSERT IGNORE INTO rebaseline_targets (target_id, reason, created_at)
+SELECT id, 'charset', NOW()
+FROM scraping_targets
+WHERE check_lastmodified = FALSE;
+
+DELETE FROM fetch_state
+WHERE target_id IN (SELECT target_id FROM rebaseline_targets);
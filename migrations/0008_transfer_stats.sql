@@ -0,0 +1,23 @@
+-- 0008_transfer_stats.sql
+-- 転送量をaction_logsにターゲット毎・実行毎の行として記録するのをやめ、
+-- ターゲット毎の累計をtransfer_statsに、実行毎の合計をtransfer_runsに記録します。
+
+CREATE TABLE IF NOT EXISTS transfer_stats (
+  target_id INT PRIMARY KEY,
+  fetch_count INT NOT NULL DEFAULT 0,
+  wire_bytes BIGINT NOT NULL DEFAULT 0,
+  body_bytes BIGINT NOT NULL DEFAULT 0,
+  last_wire_bytes BIGINT,
+  last_body_bytes BIGINT,
+  updated_at DATETIME NOT NULL,
+  FOREIGN KEY (target_id) REFERENCES scraping_targets(id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
+
+CREATE TABLE IF NOT EXISTS transfer_runs (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  run_at DATETIME NOT NULL,
+  target_count INT NOT NULL,
+  wire_bytes BIGINT NOT NULL,
+  body_bytes BIGINT NOT NULL,
+  INDEX idx_transfer_runs_run_at (run_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci;
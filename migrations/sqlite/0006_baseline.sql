@@ -0,0 +1,156 @@
+-- 0006_baseline.sql
+-- SQLite(GLC_DB_BACKEND=sqlite)の初期スキーマ。MySQL用のmigrations/0001から0006までを適用した状態に相当します。
+-- 以降のマイグレーションはmigrations/とmigrations/sqlite/の両方に同じ番号で追加してください。
+--
+-- MySQLとの違い
+-- - AUTO_INCREMENTはINTEGER PRIMARY KEY、ENUMはCHECK制約
+-- - scraping_targets.updated_atのON UPDATE CURRENT_TIMESTAMPはトリガーで更新
+-- - 日時はNOW()と同じ現地時刻の'YYYY-MM-DD HH:MM:SS'形式の文字列
+
+CREATE TABLE IF NOT EXISTS user_agents (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  agent TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS scraping_targets (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  url TEXT NOT NULL UNIQUE,
+  title TEXT NOT NULL,
+  owner TEXT NOT NULL,
+  ownerurl TEXT NOT NULL,
+  check_lastmodified BOOLEAN NOT NULL,
+  tag TEXT,
+  tag_id TEXT,
+  tag_class TEXT,
+  extractor VARCHAR(16),
+  max_body_bytes INT,
+  discovery_url TEXT,
+  email_recipient TEXT,
+  qmd_name CHAR(8) NOT NULL UNIQUE,
+  updated_at TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+  CHECK (check_lastmodified = TRUE OR (check_lastmodified = FALSE AND tag IS NOT NULL))
+);
+
+CREATE TRIGGER IF NOT EXISTS scraping_targets_updated_at
+AFTER UPDATE ON scraping_targets
+FOR EACH ROW WHEN NEW.updated_at = OLD.updated_at
+BEGIN
+  UPDATE scraping_targets SET updated_at = datetime('now', 'localtime') WHERE id = NEW.id;
+END;
+
+CREATE TABLE IF NOT EXISTS scraping_results (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  target_id INT NOT NULL REFERENCES scraping_targets(id),
+  content_digest BLOB,
+  last_update DATETIME
+);
+
+CREATE TABLE IF NOT EXISTS archive_urls (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  target_id INT NOT NULL REFERENCES scraping_targets(id),
+  archive_url TEXT NOT NULL,
+  created_at DATETIME NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pending_archives (
+  target_id INT PRIMARY KEY REFERENCES scraping_targets(id),
+  url TEXT NOT NULL,
+  created_at DATETIME NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS action_logs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  target_id INT NOT NULL REFERENCES scraping_targets(id),
+  action_type TEXT NOT NULL CHECK (action_type IN ('check', 'archive', 'tweet', 'toot', 'email')),
+  status BOOLEAN NOT NULL DEFAULT FALSE,
+  action_time DATETIME NOT NULL,
+  message TEXT
+);
+
+CREATE TABLE IF NOT EXISTS fetch_state (
+  target_id INT PRIMARY KEY REFERENCES scraping_targets(id),
+  etag TEXT,
+  last_modified VARCHAR(64),
+  body_hash CHAR(64),
+  content_hash CHAR(128),
+  next_check_at DATETIME,
+  discovery_lastmod VARCHAR(64),
+  updated_at DATETIME
+);
+
+CREATE TABLE IF NOT EXISTS host_failures (
+  host VARCHAR(255) PRIMARY KEY,
+  consecutive_failures INT NOT NULL DEFAULT 0,
+  last_failure_at DATETIME,
+  retry_after DATETIME,
+  last_error TEXT
+);
+
+CREATE TABLE IF NOT EXISTS email_settings (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  smtp_from VARCHAR(255) NOT NULL,
+  smtp_to VARCHAR(255) NOT NULL,
+  subject_template TEXT NOT NULL,
+  body_template TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS change_events (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  target_id INT NOT NULL REFERENCES scraping_targets(id),
+  result_id INT NOT NULL UNIQUE,
+  last_update DATETIME,
+  archive_url TEXT,
+  detected_at DATETIME NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS target_stats (
+  target_id INT PRIMARY KEY REFERENCES scraping_targets(id),
+  update_count INT NOT NULL DEFAULT 0,
+  first_change_at DATETIME,
+  last_change_at DATETIME,
+  last_archived_at DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS idx_scraping_targets_updated_at ON scraping_targets (updated_at);
+CREATE INDEX IF NOT EXISTS idx_scraping_results_target_id_id ON scraping_results (target_id, id);
+CREATE INDEX IF NOT EXISTS idx_scraping_results_last_update ON scraping_results (last_update);
+CREATE INDEX IF NOT EXISTS idx_archive_urls_target_id ON archive_urls (target_id);
+CREATE INDEX IF NOT EXISTS idx_action_logs_target_id ON action_logs (target_id);
+CREATE INDEX IF NOT EXISTS idx_action_logs_action_time ON action_logs (action_time);
+CREATE INDEX IF NOT EXISTS idx_change_events_target_id_id ON change_events (target_id, id);
+CREATE INDEX IF NOT EXISTS idx_change_events_last_update ON change_events (last_update);
+
+DROP VIEW IF EXISTS qmd_view;
+CREATE VIEW qmd_view AS
+SELECT
+    t.owner,
+    t.title,
+    t.qmd_name,
+    s.update_count,
+    s.last_change_at
+FROM
+    scraping_targets t
+LEFT JOIN
+    target_stats s ON s.target_id = t.id
+WHERE
+    t.check_lastmodified = 1 OR s.update_count > 0
+ORDER BY
+    t.owner, t.title;
+
+DROP VIEW IF EXISTS updated_targets_view;
+CREATE VIEW updated_targets_view AS
+SELECT
+    t.id,
+    e.last_update,
+    t.owner,
+    t.ownerurl,
+    t.title,
+    t.url,
+    e.archive_url,
+    t.qmd_name
+FROM
+    change_events e
+JOIN
+    scraping_targets t ON t.id = e.target_id
+ORDER BY
+    e.last_update DESC;
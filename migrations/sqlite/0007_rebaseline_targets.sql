@@ -0,0 +1,17 @@
+-- 0007_rebaseline_targets.sql
+-- MySQL用の0007_rebaseline_targets.sqlと同じく、デコード方法の変更でダイジェストが変わる
+-- check_lastmodified=FALSEのターゲットを登録し、次回の取得で最新のダイジェストを置き換えます。
+
+CREATE TABLE IF NOT EXISTS rebaseline_targets (
+  target_id INT PRIMARY KEY REFERENCES scraping_targets(id),
+  reason VARCHAR(64) NOT NULL,
+  created_at DATETIME NOT NULL
+);
+
+INSERT OR IGNORE INTO rebaseline_targets (target_id, reason, created_at)
+SELECT id, 'charset', datetime('now', 'localtime')
+FROM scraping_targets
+WHERE check_lastmodified = FALSE;
+
+DELETE FROM fetch_state
+WHERE target_id IN (SELECT target_id FROM rebaseline_targets);
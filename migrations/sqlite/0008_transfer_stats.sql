@@ -0,0 +1,22 @@
+-- 0008_transfer_stats.sql
+-- MySQL用の0008_transfer_stats.sqlと同じく、ターゲット毎の転送量の累計と実行毎の合計を記録するテーブルを作成します。
+
+CREATE TABLE IF NOT EXISTS transfer_stats (
+  target_id INT PRIMARY KEY REFERENCES scraping_targets(id),
+  fetch_count INT NOT NULL DEFAULT 0,
+  wire_bytes BIGINT NOT NULL DEFAULT 0,
+  body_bytes BIGINT NOT NULL DEFAULT 0,
+  last_wire_bytes BIGINT,
+  last_body_bytes BIGINT,
+  updated_at DATETIME NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS transfer_runs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  run_at DATETIME NOT NULL,
+  target_count INT NOT NULL,
+  wire_bytes BIGINT NOT NULL,
+  body_bytes BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_transfer_runs_run_at ON transfer_runs (run_at);
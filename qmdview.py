@@ -1,20 +1,11 @@
 #!/usr/bin/env python3
 
-import os
-import mysql.connector
 from dotenv import load_dotenv
+from glc_db import get_db_connection, DB_ERRORS
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
-def get_db_connection(db_name):
-    return mysql.connector.connect(
-        host=os.getenv('DB_HOST'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        database=db_name
-    )
-
 def get_qmd_names(cursor):
     cursor.execute("SELECT DISTINCT qmd_name FROM scraping_targets")
     return [row[0] for row in cursor.fetchall()]
@@ -27,24 +18,23 @@ def check_qmd_views(db_name):
         qmd_names = get_qmd_names(cursor)
         
         print(f"Database: {db_name}")
-        print("QMD Views:")
+        print("QMD Updates:")
         
         for qmd_name in qmd_names:
-            view_name = f"{qmd_name}_view"
-            cursor.execute(f"SHOW TABLES LIKE '{view_name}'")
-            if cursor.fetchone():
-                print(f"\n{view_name}:")
-                cursor.execute(f"SELECT * FROM {view_name}")
-                results = cursor.fetchall()
-                if results:
-                    for row in results:
-                        print(row)
-                else:
-                    print("null")
+            print(f"\n{qmd_name}:")
+            cursor.execute("""
+                SELECT qmd_name, owner, ownerurl, title, url, last_update
+                FROM updated_targets_view
+                WHERE qmd_name = %s
+            """, (qmd_name,))
+            results = cursor.fetchall()
+            if results:
+                for row in results:
+                    print(row)
             else:
-                print(f"\n{view_name}: Does not exist")
+                print("null")
 
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Error: {err}")
     finally:
         cursor.close()
@@ -52,7 +42,7 @@ def check_qmd_views(db_name):
 
 if __name__ == "__main__":
     import argparse
-    parser = argparse.ArgumentParser(description="Check QMD views in the database")
+    parser = argparse.ArgumentParser(description="Show the update history of each qmd_name")
     parser.add_argument("--db", required=True, help="Database name")
     args = parser.parse_args()
 
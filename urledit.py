@@ -1,23 +1,26 @@
 #!/usr/bin/env python3
 
 # urledit.py
-# Version 1.11.0
+# Version 1.12.0
 # Changes:
+# - Added --max_body_bytes option to add and edit actions
+# - edit_url now deletes the fetch_state row when url, check_lastmodified, tag, tag_id or tag_class changes
 # - Updated delete_url function to use URL instead of ID
 # - Added cascade delete for related records in other tables
 # - Updated edit_url function to handle multiple classes in tag_class
 # - Removed add_from_json and export_json actions
 
 import argparse
-import mysql.connector
 from dotenv import load_dotenv
+from glc_db import DB_ERRORS
 #from glc_spn import archive_and_save
 import time
 import os
 import json
 import string
 import secrets
-from glc_utils import get_db_connection, get_initial_content, calculate_sha3_512
+from glc_utils import get_db_connection, get_initial_content, calculate_digest
+from glc_diff import check_updates
 
 load_dotenv()
 
@@ -42,7 +45,8 @@ def archive_url(db_name, target_id, url):
     last_archive_time = time.time()
     return archive_url
 
-def add_url(db_name, url, title, owner, ownerurl, check_lastmodified, tag, tag_id, tag_class, email_recipient, qmd_name=None):
+def add_url(db_name, url, title, owner, ownerurl, check_lastmodified, tag, tag_id, tag_class, email_recipient, qmd_name=None, extractor=None, discovery_url=None,
+            max_body_bytes=None):
     if check_lastmodified is None:
         check_lastmodified = False  # デフォルト値
 
@@ -58,6 +62,9 @@ def add_url(db_name, url, title, owner, ownerurl, check_lastmodified, tag, tag_i
         "tag": tag,
         "tag_id": tag_id,
         "tag_class": tag_class,
+        "extractor": extractor,
+        "max_body_bytes": max_body_bytes,
+        "discovery_url": discovery_url,
         "email_recipient": email_recipient,
         "qmd_name": qmd_name
     }
@@ -74,9 +81,9 @@ def add_url(db_name, url, title, owner, ownerurl, check_lastmodified, tag, tag_i
     try:
         cursor.execute("""
             INSERT INTO scraping_targets
-            (url, title, owner, ownerurl, check_lastmodified, tag, tag_id, tag_class, email_recipient, qmd_name)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (url, title, owner, ownerurl, check_lastmodified, tag, tag_id, tag_class, email_recipient, qmd_name))
+            (url, title, owner, ownerurl, check_lastmodified, tag, tag_id, tag_class, extractor, max_body_bytes, discovery_url, email_recipient, qmd_name)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (url, title, owner, ownerurl, check_lastmodified, tag, tag_id, tag_class, extractor, max_body_bytes, discovery_url, email_recipient, qmd_name))
         conn.commit()
 
         print(f"URLを追加しました: {url}")
@@ -88,22 +95,25 @@ def add_url(db_name, url, title, owner, ownerurl, check_lastmodified, tag, tag_i
         # Get initial content
         cursor.execute("SELECT agent FROM user_agents ORDER BY RAND() LIMIT 1")
         user_agent = cursor.fetchone()[0]
-        last_content, last_update, content_hash = get_initial_content(url, check_lastmodified, tag, tag_id, tag_class, user_agent)
+        last_content, last_update, content_hash = get_initial_content(url, check_lastmodified, tag, tag_id, tag_class, user_agent, extractor=extractor,
+                                                                     max_body_bytes=max_body_bytes)
 
         # If check_lastmodified is False, store the hash of the scraped content
-        if not check_lastmodified and last_content:
-            last_content = calculate_sha3_512(last_content)
+        # 抽出したテキスト(check_lastmodified=FALSE)またはLast-Modifiedの文字列のダイジェストを格納
+        content_digest = calculate_digest(last_content) if last_content else None
 
         # Insert into scraping_results
         cursor.execute("""
-            INSERT INTO scraping_results (target_id, last_content, last_update, content_hash)
-            VALUES (%s, %s, %s, %s)
-        """, (target_id, last_content, last_update, content_hash))
+            INSERT INTO scraping_results (target_id, content_digest, last_update)
+            VALUES (%s, %s, %s)
+        """, (target_id, content_digest, last_update))
         conn.commit()
+        # Last-Modifiedのターゲットは最初の行もchange_eventsに記録する
+        check_updates(conn, target_ids=[target_id])
 
         archive_url(db_name, target_id, url)
 
-    except mysql.connector.Error as e:
+    except DB_ERRORS as e:
         print(f"URLの追加またはアーカイブ中にエラーが発生しました: {e}")
         conn.rollback()
     finally:
@@ -112,6 +122,9 @@ def add_url(db_name, url, title, owner, ownerurl, check_lastmodified, tag, tag_i
 
 
 
+# 変更するとfetch_stateの条件付きリクエスト・ハッシュ値を破棄する項目
+FETCH_STATE_FIELDS = ('url', 'check_lastmodified', 'tag', 'tag_id', 'tag_class')
+
 def edit_url(db_name, url, **kwargs):
     conn = get_db_connection(db_name)
     if conn is None:
@@ -140,12 +153,15 @@ def edit_url(db_name, url, **kwargs):
         if update_fields:
             update_query = f"UPDATE scraping_targets SET {', '.join(update_fields)} WHERE id = %s"
             cursor.execute(update_query, (*update_values, target_id))
+            # 取得先や抽出対象が変わると、保存済みのETag/Last-Modifiedとハッシュ値は使えない
+            if any(kwargs.get(key) is not None for key in FETCH_STATE_FIELDS):
+                cursor.execute("DELETE FROM fetch_state WHERE target_id = %s", (target_id,))
             conn.commit()
             print(f"URL {url} を更新しました。")
         else:
             print("更新する項目がありません。")
 
-    except mysql.connector.Error as e:
+    except DB_ERRORS as e:
         print(f"URLの更新中にエラーが発生しました: {e}")
         conn.rollback()
     finally:
@@ -174,6 +190,12 @@ def delete_url(db_name, url):
         cursor.execute("DELETE FROM archive_urls WHERE target_id = %s", (target_id,))
         cursor.execute("DELETE FROM action_logs WHERE target_id = %s", (target_id,))
         cursor.execute("DELETE FROM scraping_results WHERE target_id = %s", (target_id,))
+        cursor.execute("DELETE FROM change_events WHERE target_id = %s", (target_id,))
+        cursor.execute("DELETE FROM target_stats WHERE target_id = %s", (target_id,))
+        cursor.execute("DELETE FROM fetch_state WHERE target_id = %s", (target_id,))
+        cursor.execute("DELETE FROM pending_archives WHERE target_id = %s", (target_id,))
+        cursor.execute("DELETE FROM rebaseline_targets WHERE target_id = %s", (target_id,))
+        cursor.execute("DELETE FROM transfer_stats WHERE target_id = %s", (target_id,))
 
         # Delete the main record from scraping_targets
         cursor.execute("DELETE FROM scraping_targets WHERE id = %s", (target_id,))
@@ -181,7 +203,7 @@ def delete_url(db_name, url):
 
         print(f"URLを削除しました: {url}")
 
-    except mysql.connector.Error as e:
+    except DB_ERRORS as e:
         print(f"URLの削除中にエラーが発生しました: {e}")
         conn.rollback()
     finally:
@@ -197,8 +219,8 @@ def list_urls(db_name):
     try:
         cursor.execute("SELECT * FROM scraping_targets")
         urls = cursor.fetchall()
-        print(json.dumps(urls, indent=2, ensure_ascii=False))
-    except mysql.connector.Error as e:
+        print(json.dumps(urls, indent=2, ensure_ascii=False, default=str))
+    except DB_ERRORS as e:
         print(f"URLの一覧取得中にエラーが発生しました: {e}")
     finally:
         cursor.close()
@@ -218,13 +240,17 @@ def main():
     parser.add_argument("--tag", help="HTML tag to scrape")
     parser.add_argument("--tag_id", help="ID of the HTML tag to scrape")
     parser.add_argument("--tag_class", help="Class of the HTML tag to scrape")
+    parser.add_argument("--extractor", choices=['bs4', 'lxml'], help="HTML extraction backend for this URL (default: GLC_EXTRACTOR)")
+    parser.add_argument("--max_body_bytes", type=int, help="Maximum response body size in bytes for this URL (default: GLC_MAX_BODY_BYTES)")
+    parser.add_argument("--discovery_url", help="RSS/Atom feed or sitemap.xml whose dates decide whether this URL needs fetching")
     parser.add_argument("--email_recipient", help="Email recipient")
     args = parser.parse_args()
 
     if args.action == 'add':
         add_url(args.db, args.url, args.title, args.owner, args.ownerurl,
                 args.check_lastmodified == 'true' if args.check_lastmodified else None,
-                args.tag, args.tag_id, args.tag_class, args.email_recipient)
+                args.tag, args.tag_id, args.tag_class, args.email_recipient, extractor=args.extractor,
+                discovery_url=args.discovery_url, max_body_bytes=args.max_body_bytes)
     elif args.action == 'edit':
         if not args.url:
             print("編集するURLを指定してください。")
@@ -1,17 +1,17 @@
 #!/usr/bin/env python3
 # urljson.py
-# Version 1.2.0
+# Version 1.4.0
 # JSON import and export functions for URL management
-# 修正内容: glc_spn.pyの変更に合わせて更新、get_random_user_agentの使用を追加
+# 修正内容: インポートでmax_body_bytesを登録(エクスポートはSELECT *のため従来から含まれる)
 
 import json
 import argparse
 import time
 import os
 from dotenv import load_dotenv
-import mysql.connector
-from glc_utils import get_db_connection, get_initial_content, calculate_sha3_512, get_random_user_agent
+from glc_utils import get_db_connection, get_initial_content, calculate_digest, get_random_user_agent
 from glc_spn import URLArchiver
+from glc_diff import check_updates
 
 load_dotenv()
 
@@ -39,29 +39,6 @@ def archive_url(db_name, target_id, url):
     last_archive_time = time.time()
     return archive_url
 
-def create_qmd_view(db_name, qmd_name):
-    conn = get_db_connection(db_name)
-    if conn is None:
-        return
-    cursor = conn.cursor()
-    try:
-        view_name = f"{qmd_name}_view"
-        query = f"""
-        CREATE OR REPLACE VIEW {view_name} AS
-        SELECT qmd_name, owner, ownerurl, title, url, last_update
-        FROM updated_targets_view
-        WHERE qmd_name = '{qmd_name}';
-        """
-        cursor.execute(query)
-        conn.commit()
-        print(f"ビュー '{view_name}' を作成しました。")
-    except mysql.connector.Error as err:
-        print(f"ビューの作成中にエラーが発生しました: {err}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
-
 def add_urls_from_json(db_name, json_file):
     with open(json_file, 'r') as file:
         urls_data = json.load(file)
@@ -89,8 +66,8 @@ def add_urls_from_json(db_name, json_file):
 
             cursor.execute("""
                 INSERT INTO scraping_targets
-                (url, title, owner, ownerurl, check_lastmodified, tag, tag_id, tag_class, email_recipient, qmd_name)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                (url, title, owner, ownerurl, check_lastmodified, tag, tag_id, tag_class, extractor, max_body_bytes, discovery_url, email_recipient, qmd_name)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (
                 url_data['url'],
                 url_data['title'],
@@ -100,6 +77,9 @@ def add_urls_from_json(db_name, json_file):
                 url_data.get('tag'),
                 url_data.get('tag_id'),
                 url_data.get('tag_class'),
+                url_data.get('extractor'),
+                url_data.get('max_body_bytes'),
+                url_data.get('discovery_url'),
                 url_data.get('email_recipient'),
                 qmd_name
             ))
@@ -115,25 +95,26 @@ def add_urls_from_json(db_name, json_file):
                 url_data.get('tag'),
                 url_data.get('tag_id'),
                 url_data.get('tag_class'),
-                user_agent
+                user_agent,
+                extractor=url_data.get('extractor'),
+                max_body_bytes=url_data.get('max_body_bytes')
             )
 
-            if not check_lastmodified and last_content:
-                last_content = calculate_sha3_512(last_content)
+            # 抽出したテキスト(check_lastmodified=FALSE)またはLast-Modifiedの文字列のダイジェストを格納
+            content_digest = calculate_digest(last_content) if last_content else None
 
             cursor.execute("""
-                INSERT INTO scraping_results (target_id, last_content, last_update, content_hash)
-                VALUES (%s, %s, %s, %s)
-            """, (target_id, last_content, last_update, content_hash))
+                INSERT INTO scraping_results (target_id, content_digest, last_update)
+                VALUES (%s, %s, %s)
+            """, (target_id, content_digest, last_update))
             conn.commit()
+            # Last-Modifiedのターゲットは最初の行もchange_eventsに記録する
+            check_updates(conn, target_ids=[target_id])
 
             print(f"URLを追加しました: {url_data['url']}")
 
             archive_url(db_name, target_id, url_data['url'])
 
-            # 新しいqmd_nameに対応するビューを作成
-            create_qmd_view(db_name, qmd_name)
-
         except Exception as e:
             print(f"URLの追加中にエラーが発生しました: {e}")
             conn.rollback()
@@ -152,7 +133,7 @@ def export_to_json(db_name, output_file):
         cursor.execute("SELECT * FROM scraping_targets")
         urls = cursor.fetchall()
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(urls, f, ensure_ascii=False, indent=2)
+            json.dump(urls, f, ensure_ascii=False, indent=2, default=str)
         print(f"URLデータをJSONファイルにエクスポートしました: {output_file}")
     except Exception as e:
         print(f"URLデータのエクスポート中にエラーが発生しました: {e}")